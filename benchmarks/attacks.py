@@ -0,0 +1,128 @@
+"""
+Checks bestiary.parse_attacks against the original ATTACK_RE/JUST_DAMAGE_RE parser, on a pinned corpus of attack texts
+and on every monster in the bestiary, and reports the throughput of both.
+Run from the repository root: python -m benchmarks.attacks
+"""
+import copy
+import logging
+import re
+import time
+
+import bestiary
+import utils
+
+LEGACY_ATTACK_RE = re.compile(r'(?:<i>)?(?:\w+ ){1,4}Attack:(?:</i>)? ([+-]?\d+) to hit, .*?(?:<i>)?'
+                              r'Hit:(?:</i>)? (?:(?:[+-]?\d+ \((.+?)\))|(?:([+-]?\d+))) (\w+) damage[., ]??'
+                              r'(?:in melee, or [+-]?\d+ \((.+?)\) (\w+) damage at range[,.]?)?'
+                              r'(?: or [+-]?\d+ \((.+?)\) (\w+) damage (?:\w+ ?)+[.,]?)?'
+                              r'(?: ?plus [+-]?\d+ \((.+?)\) (\w+) damage)?', re.IGNORECASE)
+LEGACY_JUST_DAMAGE_RE = re.compile(r'[+-]?\d+ \((.+?)\) (\w+) damage', re.IGNORECASE)
+
+CORPUS = [
+    "Melee Weapon Attack: +4 to hit, reach 5 ft., one target. Hit: 6 (1d8 + 2) slashing damage.",
+    "Melee Weapon Attack: +4 to hit, reach 5 ft., one target. Hit: 6 (1d8 + 2) slashing damage, or 7 (1d10 + 2) "
+    "slashing damage if used with two hands.",
+    "Melee Weapon Attack: +4 to hit, reach 5 ft., one target. Hit: 6 (1d8 + 2) slashing damage or 7 (1d10 + 2) "
+    "slashing damage if used with two hands, plus 3 (1d6) fire damage.",
+    "Melee or Ranged Weapon Attack: +4 to hit, reach 5 ft. or range 20/60 ft., one target. Hit: 5 (1d6 + 2) "
+    "piercing damage in melee, or 4 (1d4 + 2) piercing damage at range.",
+    "Melee Weapon Attack: +4 to hit, reach 5 ft. Hit: 6 (1d8 + 2) slashing damagein melee, or 4 (1d4 + 2) piercing "
+    "damage at range, plus 2 (1d4) poison damage.",
+    "Melee Weapon Attack: +9 to hit, reach 10 ft., one target. Hit: 15 (2d8 + 6) piercing damage plus 7 (2d6) fire "
+    "damage.",
+    "<i>Melee Weapon Attack:</i> +5 to hit, reach 5 ft., one creature. <i>Hit:</i> 1 piercing damage, and the target "
+    "must succeed on a DC 11 Constitution saving throw.",
+    "Melee Spell Attack: +7 to hit, reach 5 ft., one creature. Hit: 10 (3d6) necrotic damage.\n"
+    "Ranged Spell Attack: +7 to hit, range 120 ft., one creature. Hit: 13 (3d8) radiant damage.",
+    "Melee Weapon Attack: +6 to hit, reach 5 ft., one target. Hit: 8 (1d8 (see text) + 4) bludgeoning damage.",
+    "Melee Weapon Attack: +6 to hit, reach 5 ft., one target. The target is grappled.\n"
+    "Hit: 8 (1d8 + 4) bludgeoning damage.",
+    "Each creature in a 30-foot cone must make a DC 13 Dexterity saving throw, taking 22 (5d8) fire damage on a "
+    "failed save, or half as much damage on a successful one. It also takes 3 (1d6) cold damage.",
+    "The dragon beats its wings. Each creature within 10 feet must succeed on a DC 19 Dexterity saving throw or take "
+    "13 (2d6 + 6) bludgeoning damage and be knocked prone.",
+    "Multiattack. The creature makes two attacks: one with its bite and one with its claws.",
+]
+
+
+def legacy_parse_attacks(data):
+    """The original parse_attacks, which scans every text with both regexes."""
+    for monster in data:
+        attacks = []
+        for t in ('trait', 'action', 'reaction', 'legendary'):
+            if t in monster:
+                for entry in monster[t]:
+                    name = entry['name']
+                    raw = entry['text']
+                    raw_atks = list(LEGACY_ATTACK_RE.finditer(raw))
+                    raw_damage = list(LEGACY_JUST_DAMAGE_RE.finditer(raw))
+
+                    if raw_atks:
+                        for atk in raw_atks:
+                            if atk.group(7) and atk.group(8):  # versatile
+                                damage = f"{atk.group(7)}[{atk.group(8)}]"
+                                if atk.group(9) and atk.group(10):  # bonus damage
+                                    damage += f"+{atk.group(9)}[{atk.group(10)}]"
+                                attacks.append(
+                                    {'name': f"2 Handed {name}", 'attackBonus': atk.group(1).lstrip('+'),
+                                     'damage': damage,
+                                     'details': raw})
+                            if atk.group(5) and atk.group(6):  # ranged
+                                damage = f"{atk.group(5)}[{atk.group(6)}]"
+                                if atk.group(9) and atk.group(10):  # bonus damage
+                                    damage += f"+{atk.group(9)}[{atk.group(10)}]"
+                                attacks.append(
+                                    {'name': f"Ranged {name}", 'attackBonus': atk.group(1).lstrip('+'),
+                                     'damage': damage,
+                                     'details': raw})
+                            damage = f"{atk.group(2) or atk.group(3)}[{atk.group(4)}]"
+                            if atk.group(9) and atk.group(10):  # bonus damage
+                                damage += f"+{atk.group(9)}[{atk.group(10)}]"
+                            attacks.append(
+                                {'name': name, 'attackBonus': atk.group(1).lstrip('+'), 'damage': damage,
+                                 'details': raw})
+                    else:
+                        index = 1
+                        for dmg in raw_damage:
+                            damage = f"{dmg.group(1)}[{dmg.group(2)}]"
+                            if index > 1:
+                                name = f"{name} {index}"
+                            atk = {'name': name, 'attackBonus': None, 'damage': damage, 'details': raw}
+                            attacks.append(atk)
+                            index += 1
+        monster['attacks'] = attacks
+    return data
+
+
+def compare(monsters):
+    """Runs both parsers over copies of the monsters.
+    :returns tuple - The names of the monsters whose attacks differ, and the time each parser took."""
+    legacy_data, current_data = copy.deepcopy(monsters), copy.deepcopy(monsters)
+    start = time.perf_counter()
+    legacy_parse_attacks(legacy_data)
+    legacy = time.perf_counter() - start
+    start = time.perf_counter()
+    bestiary.parse_attacks(current_data)
+    current = time.perf_counter() - start
+    mismatches = [a['name'] for a, b in zip(legacy_data, current_data) if a['attacks'] != b['attacks']]
+    return mismatches, legacy, current
+
+
+def run():
+    utils.logger.setLevel(logging.ERROR)  # unknown tag warnings from rendering would bury the report
+    corpus = [{'name': f"Corpus {i}", 'action': [{'name': 'Attack', 'text': text}]} for i, text in enumerate(CORPUS)]
+    mismatches, _, _ = compare(corpus)
+    print(f"corpus: {len(corpus)} texts, {len(mismatches)} mismatches {mismatches}")
+
+    monsters = list(bestiary.get_bestiaries_from_web())
+    monsters = bestiary.recursive_tag(bestiary.monster_render(bestiary.parse_ac(list(bestiary.srdfilter(monsters)))))
+    mismatches, legacy, current = compare(monsters)
+    print(f"bestiary: {len(monsters)} monsters, {len(mismatches)} mismatches")
+    print(f"  legacy:  {len(monsters) / legacy:,.0f} monsters/s")
+    print(f"  current: {len(monsters) / current:,.0f} monsters/s ({legacy / current:.2f}x)")
+    for name in mismatches[:10]:
+        print(f"  MISMATCH: {name}")
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,196 @@
+"""
+Generates a deterministic synthetic corpus shaped like the 5etools data the builds read: monsters spread over several
+bestiary files, items, basic items, magic variants, objects, races with subraces and feats, at any scale.
+write_cache() lays it out as a primed offline cache, so the builds can run against it without hitting 5etools.
+"""
+import hashlib
+import json
+import os
+import random
+import shutil
+
+SOURCES = ['MM', 'VGM', 'MTF', 'PHB', 'DMG', 'XGE', 'UA', 'UAEberron']
+DAMAGE_TYPES = ['slashing', 'piercing', 'bludgeoning', 'fire', 'cold', 'poison', 'necrotic', 'radiant']
+ABILITIES = ['str', 'dex', 'con', 'int', 'wis', 'cha']
+WORDS = ['shadow', 'iron', 'ancient', 'lesser', 'greater', 'swamp', 'frost', 'ember', 'hollow', 'grim', 'pale',
+         'storm', 'dusk', 'bone', 'moss', 'ashen']
+CREATURES = ['goblin', 'drake', 'wight', 'hag', 'golem', 'naga', 'ooze', 'giant', 'knight', 'cultist', 'wolf', 'imp']
+SPELLS = ['light', 'sacred flame', 'thaumaturgy', 'bless', 'cure wounds', 'hold person', 'spiritual weapon',
+          'spirit guardians', 'dispel magic', 'fireball', 'counterspell', 'banishment']
+MONSTER_FILES = 8
+SRD_SHARE = 0.3  # share of monster and item names taken from the SRD lists, so the SRD filters have work to do
+
+SRD_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'srd')
+
+
+def srd_names(kind):
+    with open(os.path.join(SRD_DIR, f'srd-{kind}.txt')) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def sentence(rng):
+    words = rng.sample(WORDS, 6)
+    tag = rng.choice(["{@b %s}", "{@i %s}", "{@condition %s}", "{@spell %s}", "{@creature %s|mm}", "%s"])
+    words[2] = tag % words[2]
+    return ' '.join(words).capitalize() + '.'
+
+
+def paragraph(rng, sentences=3):
+    return ' '.join(sentence(rng) for _ in range(sentences))
+
+
+def attack(rng):
+    kind = rng.choice(['mw', 'mw', 'rw', 'mw,rw'])
+    n, die, bonus = rng.randint(1, 4), rng.choice([4, 6, 8, 10, 12]), rng.randint(0, 5)
+    avg = n * (die + 1) // 2 + bonus
+    damage_type = rng.choice(DAMAGE_TYPES)
+    text = (f"{{@atk {kind}}} {{@hit {rng.randint(2, 11)}}} to hit, reach 5 ft., one target. "
+            f"{{@h}}{avg} ({{@damage {n}d{die} + {bonus}}}) {damage_type} damage")
+    extra = rng.random()
+    if extra < 0.2:
+        text += f" plus {rng.randint(2, 9)} ({{@damage {rng.randint(1, 3)}d6}}) {rng.choice(DAMAGE_TYPES)} damage"
+    elif extra < 0.3:
+        text += f", or {avg + 1} ({{@damage {n}d{die + 2} + {bonus}}}) {damage_type} damage if used with two hands"
+    return text + '.'
+
+
+def entry(rng, depth=0):
+    roll = rng.random()
+    if depth > 1 or roll < 0.6:
+        return paragraph(rng)
+    if roll < 0.75:
+        return {'type': 'list', 'items': [sentence(rng) for _ in range(rng.randint(2, 4))]}
+    if roll < 0.85:
+        return {'type': 'table', 'colLabels': ['d6', 'Effect'],
+                'rows': [[str(i), sentence(rng)] for i in range(1, 7)]}
+    return {'type': 'entries', 'name': rng.choice(WORDS).title(),
+            'entries': [entry(rng, depth + 1) for _ in range(rng.randint(1, 3))]}
+
+
+def spellcasting(rng, name):
+    level = rng.randint(1, 11)
+    dc, hit = rng.randint(11, 18), rng.randint(3, 10)
+    cast = {'name': "Spellcasting", 'headerEntries': [
+        f"The {name} is a {level}th-level spellcaster. Its spellcasting ability is Wisdom "
+        f"(spell save DC {dc}, {{@hit {hit}}} to hit with spell attacks). It has the following cleric spells prepared:"]}
+    spells = [f"{{@spell {s}}}" for s in SPELLS]
+    if rng.random() < 0.5:
+        cast['will'] = rng.sample(spells, 2)
+        cast['daily'] = {'1e': rng.sample(spells, 2)}
+    else:
+        cast['spells'] = {str(lvl): {'slots': rng.randint(1, 4), 'spells': rng.sample(spells, 2)} for lvl in range(4)}
+        del cast['spells']['0']['slots']
+    return [cast]
+
+
+def monster(rng, i, source, srd):
+    name = rng.choice(srd) if rng.random() < SRD_SHARE else f"{rng.choice(WORDS).title()} {rng.choice(CREATURES)} {i}"
+    out = {'name': name, 'source': source, 'size': rng.choice('TSMLHG'),
+           'ac': [rng.randint(10, 20)] if rng.random() < 0.6 else
+           [{'ac': rng.randint(12, 20), 'from': [rng.choice(["natural armor", "{@item chain mail|phb}"])]}],
+           'hp': {'average': rng.randint(5, 200), 'formula': f"{rng.randint(1, 20)}d8"},
+           'speed': {'walk': 30}}
+    out.update({a: rng.randint(3, 24) for a in ABILITIES})
+    out['trait'] = [{'name': rng.choice(WORDS).title(), 'entries': [paragraph(rng)]} for _ in range(rng.randint(0, 4))]
+    out['action'] = [{'name': "Multiattack", 'entries': [sentence(rng)]}] + \
+                    [{'name': rng.choice(CREATURES).title(), 'entries': [attack(rng)]} for _ in range(rng.randint(1, 3))]
+    if rng.random() < 0.2:
+        out['reaction'] = [{'name': "Parry", 'entries': [paragraph(rng, 2)]}]
+    if rng.random() < 0.1:
+        out['legendary'] = [{'name': rng.choice(WORDS).title(), 'entries': [sentence(rng)]} for _ in range(3)]
+    if rng.random() < 0.15:
+        out['spellcasting'] = spellcasting(rng, name)
+    return out
+
+
+def item(rng, i, srd):
+    name = rng.choice(srd) if rng.random() < SRD_SHARE else f"{rng.choice(WORDS).title()} Blade {i}"
+    out = {'name': name, 'source': rng.choice(SOURCES), 'type': rng.choice(['M', 'R', 'LA', 'G', 'P', 'RG', 'WD']),
+           'rarity': rng.choice(['common', 'uncommon', 'rare', 'very rare']), 'weight': rng.randint(1, 20),
+           'entries': [entry(rng) for _ in range(rng.randint(1, 4))]}
+    if rng.random() < 0.3:
+        out['dmg1'] = f"1d{rng.choice([4, 6, 8])}"
+        out['dmgType'] = rng.choice('SPB')
+    return out
+
+
+def variant(rng, i):
+    return {'name': f"{rng.choice(WORDS).title()} Weapon {i}", 'type': 'GV',
+            'inherits': {'source': rng.choice(SOURCES), 'rarity': 'rare', 'entries': [paragraph(rng)],
+                         'namePrefix': f"{rng.choice(WORDS).title()} "},
+            'entries': [entry(rng) for _ in range(rng.randint(1, 2))]}
+
+
+def obj(rng, i):
+    return {'name': f"{rng.choice(WORDS).title()} Engine {i}", 'source': 'DMG', 'entries': [paragraph(rng)],
+            'actionEntries': [{'type': 'actions', 'name': rng.choice(CREATURES).title(), 'entries': [attack(rng)]}]}
+
+
+def race(rng, i, name):
+    out = {'name': name, 'source': rng.choice(SOURCES), 'size': 'M', 'speed': 30,
+           'ability': {rng.choice(ABILITIES): 2},
+           'entries': [{'type': 'entries', 'name': trait, 'entries': [entry(rng)]}
+                       for trait in ('Age', 'Alignment', 'Size', 'Languages')[:rng.randint(2, 4)]]}
+    if rng.random() < 0.4:
+        out['subraces'] = []
+        for j in range(rng.randint(1, 5)):
+            sub = {'name': f"{rng.choice(WORDS).title()} {j}", 'ability': {rng.choice(ABILITIES): 1},
+                   'entries': [{'type': 'entries', 'name': rng.choice(WORDS).title(), 'entries': [paragraph(rng)]}]}
+            if rng.random() < 0.2:
+                sub['source'] = rng.choice(SOURCES)
+            if rng.random() < 0.2:
+                sub['speed'] = 35
+            out['subraces'].append(sub)
+    return out
+
+
+def generate(scale=1, seed=0):
+    """Scale 1 is about the size of the real data: 2000 monsters, 600 items, 200 races and 80 feats.
+    :returns dict - The corpus, as the path of each file under DATA_SRC mapped to its contents."""
+    rng = random.Random(seed)
+    srd_monsters, srd_items = srd_names('monsters'), srd_names('items')
+    files = {}
+    index = {}
+    monsters = 2000 * scale
+    for f in range(MONSTER_FILES):
+        source = SOURCES[f % len(SOURCES)] + (str(f) if f >= len(SOURCES) else '')
+        index[source] = f'bestiary-{source.lower()}.json'
+        files[f'bestiary/{index[source]}'] = {
+            'monster': [monster(rng, i, source, srd_monsters) for i in range(f, monsters, MONSTER_FILES)]}
+    index['3pp-synthetic'] = 'bestiary-3pp-synthetic.json'  # skipped by the bestiary build, like real 3pp files
+    files['bestiary/bestiary-3pp-synthetic.json'] = {'monster': []}
+    files['bestiary/index.json'] = index
+
+    files['items.json'] = {'item': [item(rng, i, srd_items) for i in range(400 * scale)] +
+                                    [{'name': f"Coin {i}", 'type': '$', 'source': 'PHB'} for i in range(5)]}
+    files['basicitems.json'] = {'basicitem': [item(rng, i, srd_items) for i in range(150 * scale)]}
+    files['magicvariants.json'] = {'variant': [variant(rng, i) for i in range(50 * scale)]}
+    files['objects.json'] = {'object': [obj(rng, i) for i in range(20 * scale)]}
+    # a few names are reused on purpose, so duplicate resolution has something to rename
+    race_names = [f"{rng.choice(WORDS).title()}folk {i % (150 * scale)}" for i in range(200 * scale)]
+    files['races.json'] = {'race': [race(rng, i, name) for i, name in enumerate(race_names)]}
+    files['feats.json'] = {'feat': [{'name': f"{rng.choice(WORDS).title()} Adept {i}", 'source': rng.choice(SOURCES),
+                                     'entries': [entry(rng) for _ in range(rng.randint(1, 3))]}
+                                    for i in range(80 * scale)]}
+    return files
+
+
+def write_cache(root, scale=1, seed=0):
+    """Writes the corpus to <root>/cache, with a manifest entry for every file, so that builds run from root with
+    OFFLINE set load all of it from the cache. races.json is cached as the bare list the race build keeps there.
+    The SRD lists are copied along, as the builds read them from the working directory too.
+    :returns dict - The corpus that was written."""
+    files = generate(scale, seed)
+    manifest = {}
+    for path, data in files.items():
+        cached = os.path.join(root, 'cache', path)
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        body = json.dumps(data['race'] if path == 'races.json' else data).encode()
+        with open(cached, 'wb') as f:
+            f.write(body)
+        manifest[path] = {'etag': None, 'last_modified': None, 'sha1': hashlib.sha1(body).hexdigest()}
+    with open(os.path.join(root, 'cache', 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    shutil.copytree(SRD_DIR, os.path.join(root, 'srd'), dirs_exist_ok=True)
+    os.makedirs(os.path.join(root, 'out'), exist_ok=True)
+    return files
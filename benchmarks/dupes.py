@@ -0,0 +1,56 @@
+"""
+Checks races.fix_dupes against the original quadratic implementation on a synthetic set of races, and reports the time
+both take.
+Run from the repository root: python -m benchmarks.dupes [count], count defaulting to 50000 races.
+"""
+import copy
+import logging
+import random
+import sys
+import time
+
+import races
+import utils
+
+SOURCES = ['PHB', 'MTF', 'VGM', 'DMG', 'UA', 'UAEberron', 'UAWGtE', 'XGE', 'SCAG', 'ERLW']
+
+
+def legacy_fix_dupes(data):
+    for race in data:
+        if len([r for r in data if r['name'] == race['name']]) > 1:
+            hierarchied = sorted([r for r in data if r['name'] == race['name']],
+                                 key=lambda r: races.SOURCE_HIERARCHY.index(
+                                     next((s for s in races.SOURCE_HIERARCHY if s in r['source']), 'nil')))
+            for r in hierarchied[1:]:
+                r['name'] = f"{r['name']} ({r['source']})"
+    return data
+
+
+def synthetic_races(count, seed=0):
+    """Generates races where about a third of the names are shared, some of them by races of the same source.
+    :returns list - The races."""
+    rng = random.Random(seed)
+    names = [f"Race {i}" for i in range(count * 2 // 3)]
+    return [{'name': rng.choice(names), 'source': rng.choice(SOURCES)} for _ in range(count)]
+
+
+def run(count=50000):
+    utils.logger.setLevel(logging.ERROR)  # every duplicate is logged
+    data = synthetic_races(count)
+    legacy_data, current_data = copy.deepcopy(data), copy.deepcopy(data)
+    start = time.perf_counter()
+    legacy_fix_dupes(legacy_data)
+    legacy = time.perf_counter() - start
+    start = time.perf_counter()
+    races.fix_dupes(current_data)
+    current = time.perf_counter() - start
+
+    renamed = sum(a['name'] != b['name'] for a, b in zip(data, current_data))
+    mismatches = sum(a != b for a, b in zip(legacy_data, current_data))
+    print(f"{count} races, {renamed} renamed, {mismatches} mismatches")
+    print(f"  legacy:  {legacy:.3f}s")
+    print(f"  current: {current:.3f}s ({legacy / current:.0f}x)")
+
+
+if __name__ == '__main__':
+    run(*map(int, sys.argv[1:2]))
@@ -0,0 +1,188 @@
+"""
+Checks that a candidate build produces the same out/*.json as a reference build, record by record, and reports the
+throughput of both. Both builds run offline from copies of the same cache, in their own working directories.
+The reference is the tree at a git revision (HEAD by default, or . for the working tree as it is) and the candidate is
+the working tree, run with whatever flags follow --, so any optimized mode can be checked against the plain build:
+    python -m benchmarks.equivalence [--ref=REV] [--scale=N | --cache=DIR] [--incremental] [-- memoize --workers=4]
+Inputs come from the synthetic corpus (see benchmarks.corpus) at --scale, or from an existing cache directory, and are
+also laid out the way revisions from before the per-file cache read them, so the reference can be any revision back to
+the original scripts (--ref=<root commit>).
+--incremental compares the candidate's second, incremental, run instead of a full one.
+Exits with status 1 if any output differs.
+"""
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+from benchmarks import corpus
+
+BUILDS = ['bestiary', 'items', 'races', 'feats']
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAX_DIFFS = 20  # per build
+REPR_LENGTH = 80
+
+
+def export(rev, dest):
+    """:returns str - A directory holding the tree at rev."""
+    if rev == '.':
+        return REPO
+    archive = subprocess.run(['git', 'archive', '--format=tar', rev], cwd=REPO, capture_output=True, check=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(dest)
+    return dest
+
+
+def prepare(workdir, src, cache, scale, seed):
+    """Lays out a working directory for a build of src, with its own copy of the inputs."""
+    if cache:
+        shutil.copytree(cache, os.path.join(workdir, 'cache'))
+        os.makedirs(os.path.join(workdir, 'out'), exist_ok=True)
+    else:
+        corpus.write_cache(workdir, scale, seed)
+    write_legacy_bestiary(os.path.join(workdir, 'cache'))
+    shutil.copytree(os.path.join(src, 'srd'), os.path.join(workdir, 'srd'), dirs_exist_ok=True)
+
+
+def write_legacy_bestiary(cache):
+    """Writes <cache>/monster.json, the merged bestiary that revisions from before the per-file cache load instead of
+    the bestiary files: the monsters of every non-3pp file, in index order, as the original script saved them."""
+    path = os.path.join(cache, 'monster.json')
+    if os.path.exists(path):
+        return
+    with open(os.path.join(cache, 'bestiary', 'index.json')) as f:
+        index = json.load(f)
+    monsters = []
+    for src, file in index.items():
+        if '3pp' in src:
+            continue
+        with open(os.path.join(cache, 'bestiary', file)) as f:
+            monsters.extend(json.load(f)['monster'])
+    with open(path, 'w') as f:
+        json.dump(monsters, f, indent=2)
+
+
+def run_build(src, workdir, build, flags):
+    """Runs one build in a fresh interpreter.
+    :returns float - The time it took."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [src, os.environ.get('PYTHONPATH')])))
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-c', f"import {build}; {build}.run()", 'offline', *flags], cwd=workdir,
+                          env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - start
+    if proc.returncode:
+        raise RuntimeError(f"{build} failed in {workdir}:\n{proc.stderr[-2000:]}")
+    return elapsed
+
+
+def load_output(workdir, build):
+    """:returns list - The records a build wrote, from whichever of its output formats is there."""
+    path = os.path.join(workdir, 'out', build)
+    if os.path.exists(f'{path}.json'):
+        with open(f'{path}.json') as f:
+            return json.load(f)
+    with open(f'{path}.ndjson') as f:
+        return [json.loads(line) for line in f]
+
+
+def short(value):
+    text = repr(value)
+    return text if len(text) <= REPR_LENGTH else f"{text[:REPR_LENGTH - 3]}..."
+
+
+def diff(a, b, path, out):
+    """Appends a line to out for every place where b differs from a."""
+    if type(a) is not type(b):
+        out.append(f"{path}: {short(a)} != {short(b)}")
+    elif isinstance(a, dict):
+        for k in a:
+            if k not in b:
+                out.append(f"{path}.{k}: missing")
+            else:
+                diff(a[k], b[k], f"{path}.{k}", out)
+        out.extend(f"{path}.{k}: unexpected {short(b[k])}" for k in b if k not in a)
+    elif isinstance(a, list):
+        if len(a) != len(b):
+            out.append(f"{path}: {len(a)} items != {len(b)} items")
+        for i, (x, y) in enumerate(zip(a, b)):
+            diff(x, y, f"{path}[{i}]", out)
+    elif a != b:
+        out.append(f"{path}: {short(a)} != {short(b)}")
+    return out
+
+
+def keyed(records):
+    """:returns dict - The records by name, source and how many records with that name and source came before."""
+    seen = {}
+    out = {}
+    for r in records:
+        key = (r.get('name'), r.get('source'))
+        seen[key] = seen.get(key, 0) + 1
+        out[(*key, seen[key])] = r
+    return out
+
+
+def compare(reference, candidate):
+    """:returns list - Every difference between the two outputs, one line each."""
+    ref, cand = keyed(reference), keyed(candidate)
+    diffs = []
+    for key, record in ref.items():
+        label = f"{key[0]} ({key[1]})" + (f" #{key[2]}" if key[2] > 1 else '')
+        if key not in cand:
+            diffs.append(f"{label}: missing")
+        else:
+            diff(record, cand[key], label, diffs)
+    diffs.extend(f"{k[0]} ({k[1]}): unexpected" for k in cand if k not in ref)
+    if not diffs and list(ref) != list(cand):
+        diffs.append("records are in a different order")
+    return diffs
+
+
+def run():
+    args, flags = sys.argv[1:], []
+    if '--' in args:
+        args, flags = args[:args.index('--')], args[args.index('--') + 1:]
+    opts = dict(a[2:].split('=', 1) if '=' in a else (a[2:], True) for a in args if a.startswith('--'))
+    rev, cache = opts.get('ref', 'HEAD'), opts.get('cache')
+    scale, seed = int(opts.get('scale', 1)), int(opts.get('seed', 0))
+    builds = opts['builds'].split(',') if 'builds' in opts else BUILDS
+    cache = os.path.abspath(cache) if cache else None
+
+    failed = False
+    with tempfile.TemporaryDirectory() as root:
+        ref_src = export(rev, os.path.join(root, 'ref-src'))
+        ref_dir, cand_dir = os.path.join(root, 'ref'), os.path.join(root, 'cand')
+        prepare(ref_dir, ref_src, cache, scale, seed)
+        prepare(cand_dir, REPO, cache, scale, seed)
+        print(f"reference: {rev}, candidate: working tree {' '.join(flags) or '(no flags)'}"
+              f"{', incremental' if 'incremental' in opts else ''}, inputs: {cache or f'corpus at scale {scale}'}")
+
+        for build in builds:
+            ref_time = run_build(ref_src, ref_dir, build, ['--full'])
+            if 'incremental' in opts:
+                run_build(REPO, cand_dir, build, ['--full', *flags])
+                cand_time = run_build(REPO, cand_dir, build, flags)
+            else:
+                cand_time = run_build(REPO, cand_dir, build, ['--full', *flags])
+            reference, candidate = load_output(ref_dir, build), load_output(cand_dir, build)
+            diffs = compare(reference, candidate)
+            failed = failed or bool(diffs)
+
+            print(f"{build}: {len(reference)} records, {'OK' if not diffs else f'{len(diffs)} differences'}")
+            print(f"  reference: {ref_time:.3f}s ({len(reference) / ref_time:,.0f} records/s)")
+            print(f"  candidate: {cand_time:.3f}s ({len(candidate) / cand_time:,.0f} records/s, "
+                  f"{ref_time / cand_time:.2f}x)")
+            for line in diffs[:MAX_DIFFS]:
+                print(f"  {line}")
+            if len(diffs) > MAX_DIFFS:
+                print(f"  ...and {len(diffs) - MAX_DIFFS} more")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,80 @@
+"""
+Benchmarks utils.parse_data_formatting against the original fixpoint implementation.
+Run from the repository root: python -m benchmarks.formatting
+"""
+import logging
+import re
+import time
+
+import utils
+from bestiary import get_bestiaries_from_web
+from items import get_latest_items
+from races import get_races_from_web
+from utils import PARSING, IGNORED, FORMATTING, SRC_FORMAT
+
+log = logging.getLogger("benchmarks.formatting")
+
+
+def legacy_parse_data_formatting(text):
+    """The original parse_data_formatting: re-scans and re-substitutes until no tags are left."""
+    exp = re.compile(r'{@(\w+)(?: ([^{}]+?))?}')
+
+    def sub(match):
+        log.debug(f"Rendering {match.group(0)}...")
+        if match.group(1) in IGNORED:
+            out = SRC_FORMAT(match.group(2))
+        elif match.group(1) in PARSING:
+            f = PARSING.get(match.group(1), lambda e: e)
+            out = f(match.group(2))
+        else:
+            f = FORMATTING.get(match.group(1), '')
+            if not match.group(1) in FORMATTING:
+                log.warning(f"Unknown tag: {match.group(0)}")
+            out = f"{f}{match.group(2)}{f}"
+        log.debug(f"Replaced with {out}")
+        return out
+
+    while exp.search(text):
+        text = exp.sub(sub, text)
+    return text
+
+
+def collect_strings(value, out):
+    if isinstance(value, str):
+        out.append(value)
+    elif isinstance(value, list):
+        for v in value:
+            collect_strings(v, out)
+    elif isinstance(value, dict):
+        for v in value.values():
+            collect_strings(v, out)
+    return out
+
+
+def bench(func, strings, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for s in strings:
+            func(s)
+    return time.perf_counter() - start
+
+
+def run(rounds=5):
+    datasets = {'monsters': list(get_bestiaries_from_web()), 'items': list(get_latest_items()),
+                'races': list(get_races_from_web())}
+    utils.logger.setLevel(logging.ERROR)  # unknown tag warnings would dominate the timings
+    for name, data in datasets.items():
+        strings = collect_strings(data, [])
+        mismatches = [s for s in strings if legacy_parse_data_formatting(s) != utils.parse_data_formatting(s)]
+        legacy = bench(legacy_parse_data_formatting, strings, rounds)
+        current = bench(utils.parse_data_formatting, strings, rounds)
+        total = len(strings) * rounds
+        print(f"{name}: {len(strings)} strings, {len(mismatches)} mismatches")
+        print(f"  legacy:  {total / legacy:,.0f} strings/s")
+        print(f"  current: {total / current:,.0f} strings/s ({legacy / current:.2f}x)")
+        for s in mismatches[:5]:
+            print(f"  MISMATCH: {s!r}")
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,120 @@
+"""
+Times the build stages and the end-to-end build of every data file on a synthetic corpus (see benchmarks.corpus), run
+from a primed offline cache in a temporary directory, so nothing is fetched from 5etools.
+Prints the results as JSON, to be compared across commits.
+Run from the repository root: python -m benchmarks.pipelines [--scale=N] [--rounds=N] [--seed=N] [--out=results.json]
+Other build flags such as memoize and --workers=N apply as usual.
+"""
+import copy
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import bestiary
+import feats
+import items
+import races
+import utils
+from benchmarks import corpus
+from benchmarks.formatting import collect_strings
+
+
+def arg(name, default):
+    return next((type(default)(a.split('=', 1)[1]) for a in sys.argv if a.startswith(f'--{name}=')), default)
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(utils.__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def timed(func, data, rounds, records=None):
+    """Runs func over a fresh copy of data each round, not timing the copy.
+    :returns dict - The best and mean time taken and the throughput of the best round."""
+    times = []
+    for _ in range(rounds):
+        sample = copy.deepcopy(data)
+        start = time.perf_counter()
+        func(sample)
+        times.append(time.perf_counter() - start)
+    records = len(data) if records is None else records
+    best = min(times)
+    return {'records': records, 'best': round(best, 6), 'mean': round(sum(times) / len(times), 6),
+            'per_second': round(records / best, 1) if best else None}
+
+
+def stages(files, rounds):
+    monsters = [m for path, f in files.items() if path.startswith('bestiary/') and 'monster' in f
+                for m in f['monster']]
+    monsters_ac = bestiary.parse_ac(copy.deepcopy(monsters))
+    rendered = bestiary.monster_render(copy.deepcopy(monsters_ac))
+    tagged = bestiary.tag_monsters(copy.deepcopy(rendered))
+    item_list = list(items.variant_inheritance(
+        copy.deepcopy(files['items.json']['item'] + files['basicitems.json']['basicitem'] +
+                      files['magicvariants.json']['variant'])))
+    race_list = files['races.json']['race']
+    split = [r for rs in races.process(copy.deepcopy(race_list)) for r in rs]
+    strings = collect_strings(monsters, []) + collect_strings(item_list, []) + collect_strings(race_list, [])
+    entries = [e['entries'] for m in monsters for t in ('trait', 'action') for e in m.get(t, [])] + \
+              [i['entries'] for i in item_list if 'entries' in i]
+
+    return {
+        'parse_data_formatting': timed(lambda d: [utils.parse_data_formatting(s) for s in d], strings, rounds),
+        'render': timed(lambda d: [utils.render(e) for e in d], entries, rounds),
+        'bestiary.parse_ac': timed(bestiary.parse_ac, monsters, rounds),
+        'bestiary.monster_render': timed(bestiary.monster_render, monsters_ac, rounds),
+        'bestiary.tag_tree': timed(bestiary.tag_monsters, rendered, rounds),
+        'bestiary.parse_attacks': timed(bestiary.parse_attacks, tagged, rounds),
+        'items.prerender': timed(items.prerender, item_list, rounds),
+        'races.split_subraces': timed(races.process, race_list, rounds),
+        'races.fix_dupes': timed(races.fix_dupes, split, rounds),
+    }
+
+
+def runs(files, rounds):
+    counts = {'bestiary': sum(len(f.get('monster', [])) for path, f in files.items() if path.startswith('bestiary/')),
+              # moneyfilter drops the coins before they're written
+              'items': sum(1 for p, k in (('items.json', 'item'), ('basicitems.json', 'basicitem'),
+                                          ('magicvariants.json', 'variant'), ('objects.json', 'object'))
+                           for _ in items.moneyfilter(files[p][k])),
+              'races': len(files['races.json']['race']),
+              'feats': len(files['feats.json']['feat'])}
+    modules = {'bestiary': bestiary, 'items': items, 'races': races, 'feats': feats}
+    return {name: timed(lambda _: module.run(), None, rounds, counts[name]) for name, module in modules.items()}
+
+
+def run():
+    scale, rounds, seed = arg('scale', 1), arg('rounds', 3), arg('seed', 0)
+    out = arg('out', '')
+    utils.logger.setLevel(logging.ERROR)
+    utils.OFFLINE = True
+    utils.FULL_BUILD = True  # time the whole build, not the reuse of the previous round's outputs
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as root:
+        files = corpus.write_cache(root, scale, seed)
+        os.chdir(root)
+        try:
+            results = {'commit': commit(), 'python': platform.python_version(), 'scale': scale, 'seed': seed,
+                       'rounds': rounds, 'memoize': utils.RENDER_CACHE is not None, 'workers': utils.WORKERS,
+                       'stages': stages(files, rounds), 'runs': runs(files, rounds)}
+        finally:
+            os.chdir(cwd)
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if out:
+        with open(out, 'w') as f:
+            f.write(text)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,54 @@
+"""
+Checks that every out/*.bin record file round-trips to exactly the records in the canonical out/*.json next to it, and
+compares loading the JSON with opening the record file and decoding single records from it.
+Run from the repository root after a build with --records: python -m benchmarks.records
+"""
+import glob
+import json
+import os
+import random
+import time
+
+from recordfile import RecordFile
+
+SAMPLES = 100  # records decoded at random when timing lookups
+
+
+def check(json_path, bin_path):
+    start = time.perf_counter()
+    with open(json_path) as f:
+        canonical = json.load(f)
+    json_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    records = RecordFile(bin_path)
+    open_time = time.perf_counter() - start
+    with records:
+        mismatches = [i for i, record in enumerate(records) if i >= len(canonical) or record != canonical[i]]
+        if len(records) != len(canonical):
+            mismatches.append(f"{len(records)} records != {len(canonical)} records")
+        start = time.perf_counter()
+        for i in random.Random(0).choices(range(len(records)), k=SAMPLES if len(records) else 0):
+            _ = records[i]
+        lookup_time = (time.perf_counter() - start) / SAMPLES
+
+    print(f"{os.path.basename(json_path)}: {len(canonical)} records, "
+          f"{'OK' if not mismatches else f'{len(mismatches)} mismatches {mismatches[:10]}'}")
+    print(f"  json: {os.path.getsize(json_path):,} bytes, loaded in {json_time * 1000:.1f}ms")
+    print(f"  bin:  {os.path.getsize(bin_path):,} bytes, opened in {open_time * 1000:.3f}ms, "
+          f"{lookup_time * 1e6:.1f}us per record")
+    return not mismatches
+
+
+def run():
+    ok = True
+    for json_path in sorted(glob.glob('out/*.json')):
+        bin_path = f"{os.path.splitext(json_path)[0]}.bin"
+        if os.path.exists(bin_path):
+            ok = check(json_path, bin_path) and ok
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,55 @@
+"""
+Checks searchindex.SearchIndex.search against a linear scan with avrae's fuzzy_search semantics on every out/*.json that
+has a search index, and compares their lookup times.
+Run from the repository root after a build with --search-index: python -m benchmarks.search
+"""
+import glob
+import json
+import random
+import time
+
+from searchindex import SearchIndex
+
+QUERIES = 500
+
+
+def fuzzy_search(list_to_search, key, value):
+    """avrae's utils.functions.fuzzy_search: the first exact match ignoring case, or else the first substring match."""
+    try:
+        return next(a for a in list_to_search if value.lower() == a.get(key, '').lower())
+    except StopIteration:
+        return next((a for a in list_to_search if value.lower() in a.get(key, '').lower()), None)
+
+
+def queries(records, rng):
+    names = [r.get('name', '') for r in records] or ['']
+    out = []
+    for _ in range(QUERIES):
+        name = rng.choice(names)
+        start = rng.randrange(max(len(name), 1))
+        out.append(rng.choice([name, name.upper(), name[start:start + rng.randint(1, 8)], f"{name}x", "zzz"]))
+    return out
+
+
+def run():
+    for index_path in sorted(glob.glob('out/*.index.json')):
+        with open(index_path.replace('.index.json', '.json')) as f:
+            records = json.load(f)
+        index = SearchIndex.load(index_path)
+        qs = queries(records, random.Random(0))
+
+        start = time.perf_counter()
+        expected = [fuzzy_search(records, 'name', q) for q in qs]
+        linear = time.perf_counter() - start
+        start = time.perf_counter()
+        found = [index.search(q) for q in qs]
+        indexed = time.perf_counter() - start
+
+        mismatches = [q for q, e, i in zip(qs, expected, found) if e is not (records[i] if i is not None else None)]
+        print(f"{index_path}: {len(records)} records, {len(qs)} queries, {len(mismatches)} mismatches {mismatches[:5]}")
+        print(f"  linear:  {linear / len(qs) * 1e6:,.1f}us per query")
+        print(f"  indexed: {indexed / len(qs) * 1e6:,.1f}us per query ({linear / indexed:.1f}x)")
+
+
+if __name__ == '__main__':
+    run()
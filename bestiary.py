@@ -1,48 +1,43 @@
+from pipeline import Pipeline, stage
+from srdindex import is_srd
 from utils import *
 
-ATTACK_RE = re.compile(r'(?:<i>)?(?:\w+ ){1,4}Attack:(?:</i>)? ([+-]?\d+) to hit, .*?(?:<i>)?'
-                       r'Hit:(?:</i>)? (?:(?:[+-]?\d+ \((.+?)\))|(?:([+-]?\d+))) (\w+) damage[., ]??'
-                       r'(?:in melee, or [+-]?\d+ \((.+?)\) (\w+) damage at range[,.]?)?'
-                       r'(?: or [+-]?\d+ \((.+?)\) (\w+) damage (?:\w+ ?)+[.,]?)?'
-                       r'(?: ?plus [+-]?\d+ \((.+?)\) (\w+) damage)?', re.IGNORECASE)
+ATTACK_HEAD_RE = re.compile(r'(?:\w+ ){1,4}Attack:(?:</i>)? ([+-]?\d+) to hit, ', re.IGNORECASE)
+ATTACK_HIT_RE = re.compile(r'Hit:(?:</i>)? ', re.IGNORECASE)
+DICE_DAMAGE_RE = re.compile(r'[+-]?\d+ \(')
+FLAT_DAMAGE_RE = re.compile(r'([+-]?\d+) (\w+) damage', re.IGNORECASE)
+RANGED_DAMAGE_RE = re.compile(r'in melee, or [+-]?\d+ \(', re.IGNORECASE)
+VERSATILE_DAMAGE_RE = re.compile(r' or [+-]?\d+ \(', re.IGNORECASE)
+BONUS_DAMAGE_RE = re.compile(r' ?plus [+-]?\d+ \(', re.IGNORECASE)
+DAMAGE_TAIL_RE = re.compile(r'\) (\w+) damage', re.IGNORECASE)
+RANGED_TAIL_RE = re.compile(r'\) (\w+) damage at range[,.]?', re.IGNORECASE)
+VERSATILE_TAIL_RE = re.compile(r'\) (\w+) damage \w+(?: \w+)* ?[.,]?', re.IGNORECASE)
 JUST_DAMAGE_RE = re.compile(r'[+-]?\d+ \((.+?)\) (\w+) damage', re.IGNORECASE)
+AttackText = collections.namedtuple('AttackText', 'to_hit damage flat_damage damage_type ranged_damage ranged_type '
+                                                  'versatile_damage versatile_type bonus_damage bonus_type')
 log = logging.getLogger("bestiary")
 
 
 def get_bestiaries_from_web():
-    try:
-        with open('cache/monster.json') as f:
-            monsters = json.load(f)
-            log.info("Loaded monster data from cache")
-    except FileNotFoundError:
-        index = get_json('bestiary/index.json')
-        monsters = []
-        for src, file in index.items():
-            if '3pp' in src:
-                continue
-            data = get_json(f"bestiary/{file}")
-            monsters.extend(data['monster'])
-            log.info(f"  Processed {file}: {len(data['monster'])} monsters")
-        with open('cache/monster.json', 'w') as f:
-            json.dump(monsters, f, indent=2)
-    return monsters
+    index = get_sources(['bestiary/index.json'])[0]
+    files = [file for src, file in index.items() if '3pp' not in src]
+    for file, monsters in zip(files, get_sources([f"bestiary/{file}" for file in files], key='monster')):
+        n = 0
+        for n, monster in enumerate(monsters, 1):
+            yield monster
+        log.info(f"  Processed {file}: {n} monsters")
 
 
 def srdfilter(data):
-    with open('srd/srd-monsters.txt') as f:
-        srd = [s.strip().lower() for s in f.read().split('\n')]
-
     for monster in data:
-        if monster['name'].lower() in srd:
-            monster['srd'] = True
-        else:
-            monster['srd'] = False
-    return data
+        monster['srd'] = is_srd('monster', monster)
+        yield monster
 
 
 def parse_ac(data):
     for monster in data:
-        log.info(f"Parsing {monster['name']} AC")
+        if DEBUG:
+            log.debug(f"Parsing {monster['name']} AC")
         if isinstance(monster['ac'][0], int):
             monster['ac'] = {'ac': int(monster['ac'][0])}
         elif isinstance(monster['ac'][0], dict):
@@ -56,9 +51,9 @@ def parse_ac(data):
 
 def monster_render(data):
     for monster in data:
-        log.info(f"Rendering {monster['name']}")
+        if DEBUG:
+            log.debug(f"Rendering {monster['name']}")
         for t in ('trait', 'action', 'reaction', 'legendary'):
-            log.info(f"  Rendering {t}s")
             if t in monster:
                 temp = []
                 for entry in monster[t]:
@@ -111,7 +106,8 @@ def monster_render(data):
             sab = usual_sab[0]
             monster['spellcasting'] = {'spells': known_spells, 'dc': dc, 'attackBonus': sab,
                                        'casterLevel': caster_level}  # overwrite old
-            log.info(f"Lvl {caster_level}; DC: {dc}; SAB: {sab}; Spells: {known_spells}")
+            if DEBUG:
+                log.debug(f"Lvl {caster_level}; DC: {dc}; SAB: {sab}; Spells: {known_spells}")
     return data
 
 
@@ -131,6 +127,62 @@ def get_spell_level(level):
     return f"{level}th level"
 
 
+def scan_attacks(text):
+    """Extracts the to-hit, primary, ranged, versatile and bonus damage of every attack in a text.
+    Each attack is read forward from its "... Attack: +X to hit, " header. Every dice group is closed by searching for
+    the first close paren that is followed by its damage type, so there is nothing for long texts to backtrack over.
+    :returns list - An AttackText for each attack, in order."""
+    attacks = []
+    pos = 0
+    while True:
+        head = ATTACK_HEAD_RE.search(text, pos)
+        if head is None:
+            return attacks
+        pos = head.end()
+        end = text.find('\n', pos)
+        if end == -1:
+            end = len(text)
+
+        for hit in ATTACK_HIT_RE.finditer(text, pos, end):  # the first hit on the same line that has damage
+            primary = scan_dice(DICE_DAMAGE_RE, DAMAGE_TAIL_RE, text, hit.end(), end)
+            if primary is not None:
+                damage, flat_damage, damage_type, pos = primary[0], None, primary[1], primary[2]
+            else:
+                flat = FLAT_DAMAGE_RE.match(text, hit.end(), end)
+                if flat is None:
+                    continue
+                damage, flat_damage, damage_type, pos = None, flat.group(1), flat.group(2), flat.end()
+
+            ranged = scan_dice(RANGED_DAMAGE_RE, RANGED_TAIL_RE, text, pos, end)
+            if ranged is not None:
+                pos = ranged[2]
+            versatile = scan_dice(VERSATILE_DAMAGE_RE, VERSATILE_TAIL_RE, text, pos, end)
+            if versatile is not None:
+                pos = versatile[2]
+            bonus = scan_dice(BONUS_DAMAGE_RE, DAMAGE_TAIL_RE, text, pos, end)
+            if bonus is not None:
+                pos = bonus[2]
+            attacks.append(AttackText(head.group(1), damage, flat_damage, damage_type,
+                                      *(ranged or (None, None))[:2], *(versatile or (None, None))[:2],
+                                      *(bonus or (None, None))[:2]))
+            break
+        else:
+            pos = end  # any later header on this line would only see the same hits
+
+
+def scan_dice(prefix_re, tail_re, text, pos, end):
+    """Matches prefix_re, which ends in an open paren, at pos, and closes it at the first close paren that tail_re
+    matches from.
+    :returns tuple - The dice, the damage type and the end of the match, or None."""
+    prefix = prefix_re.match(text, pos, end)
+    if prefix is None:
+        return None
+    tail = tail_re.search(text, prefix.end() + 1, end)
+    if tail is None:
+        return None
+    return text[prefix.end():tail.start()], tail.group(1), tail.end()
+
+
 def parse_attacks(data):
     for monster in data:
         attacks = []
@@ -139,36 +191,35 @@ def parse_attacks(data):
                 for entry in monster[t]:
                     name = entry['name']
                     raw = entry['text']
-                    raw_atks = list(ATTACK_RE.finditer(raw))
-                    raw_damage = list(JUST_DAMAGE_RE.finditer(raw))
+                    raw_atks = scan_attacks(raw)
 
                     if raw_atks:
                         for atk in raw_atks:
-                            if atk.group(7) and atk.group(8):  # versatile
-                                damage = f"{atk.group(7)}[{atk.group(8)}]"
-                                if atk.group(9) and atk.group(10):  # bonus damage
-                                    damage += f"+{atk.group(9)}[{atk.group(10)}]"
+                            if atk.versatile_damage and atk.versatile_type:  # versatile
+                                damage = f"{atk.versatile_damage}[{atk.versatile_type}]"
+                                if atk.bonus_damage and atk.bonus_type:  # bonus damage
+                                    damage += f"+{atk.bonus_damage}[{atk.bonus_type}]"
                                 attacks.append(
-                                    {'name': f"2 Handed {name}", 'attackBonus': atk.group(1).lstrip('+'),
+                                    {'name': f"2 Handed {name}", 'attackBonus': atk.to_hit.lstrip('+'),
                                      'damage': damage,
                                      'details': raw})
-                            if atk.group(5) and atk.group(6):  # ranged
-                                damage = f"{atk.group(5)}[{atk.group(6)}]"
-                                if atk.group(9) and atk.group(10):  # bonus damage
-                                    damage += f"+{atk.group(9)}[{atk.group(10)}]"
+                            if atk.ranged_damage and atk.ranged_type:  # ranged
+                                damage = f"{atk.ranged_damage}[{atk.ranged_type}]"
+                                if atk.bonus_damage and atk.bonus_type:  # bonus damage
+                                    damage += f"+{atk.bonus_damage}[{atk.bonus_type}]"
                                 attacks.append(
-                                    {'name': f"Ranged {name}", 'attackBonus': atk.group(1).lstrip('+'),
+                                    {'name': f"Ranged {name}", 'attackBonus': atk.to_hit.lstrip('+'),
                                      'damage': damage,
                                      'details': raw})
-                            damage = f"{atk.group(2) or atk.group(3)}[{atk.group(4)}]"
-                            if atk.group(9) and atk.group(10):  # bonus damage
-                                damage += f"+{atk.group(9)}[{atk.group(10)}]"
+                            damage = f"{atk.damage or atk.flat_damage}[{atk.damage_type}]"
+                            if atk.bonus_damage and atk.bonus_type:  # bonus damage
+                                damage += f"+{atk.bonus_damage}[{atk.bonus_type}]"
                             attacks.append(
-                                {'name': name, 'attackBonus': atk.group(1).lstrip('+'), 'damage': damage,
+                                {'name': name, 'attackBonus': atk.to_hit.lstrip('+'), 'damage': damage,
                                  'details': raw})
                     else:
                         index = 1
-                        for dmg in raw_damage:
+                        for dmg in JUST_DAMAGE_RE.finditer(raw):  # only scanned when there is no attack
                             damage = f"{dmg.group(1)}[{dmg.group(2)}]"
                             if index > 1:
                                 name = f"{name} {index}"
@@ -176,23 +227,40 @@ def parse_attacks(data):
                             attacks.append(atk)
                             index += 1
         monster['attacks'] = attacks
-        log.debug(f"Parsed attacks for {monster['name']}: {attacks}")
+        if DEBUG:
+            log.debug(f"Parsed attacks for {monster['name']}: {attacks}")
     return data
 
 
 def dump(data):
-    with open('out/bestiary.json', 'w') as f:
-        json.dump(data, f, indent=4)
+    dump_json(data, 'out/bestiary.json')
+
+
+def process(data):
+    return parallel_map(process_chunk, data)
+
+
+def tag_monsters(data):
+    rewritten = sum(tag_tree(monster) for monster in data)
+    log.info(f"Rendered tags in {rewritten} monster fields")
+    return data
+
+
+def process_chunk(data):
+    data = stage('parse_ac', parse_ac, data)
+    rendered = stage('monster_render', monster_render, data)
+    rendered = stage('tag_tree', tag_monsters, rendered)
+    return stage('parse_attacks', parse_attacks, rendered)
 
 
 def run():
-    data = get_bestiaries_from_web()
-    data = srdfilter(data)
-    data = parse_ac(data)
-    rendered = monster_render(data)
-    rendered = recursive_tag(rendered)
-    out = parse_attacks(rendered)
-    dump(out)
+    with Pipeline('bestiary'):
+        data = stage('fetch', get_bestiaries_from_web)
+        data = stage('srdfilter', srdfilter, data)
+        out = stage('process', run_incremental, 'bestiary', data, process)
+        stage('dump', dump, out)
+    log_render_cache_stats()
+    log_warning_summary()
 
 
 if __name__ == '__main__':
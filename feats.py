@@ -1,33 +1,32 @@
-import json
 import logging
 
-from utils import get_data
+from pipeline import Pipeline, stage
+from srdindex import is_srd
+from utils import dump_json, iter_data, log_warning_summary
 
 log = logging.getLogger("feats")
 
 
 def get_latest_feats():
-    return get_data("feats.json")['feat']
+    return iter_data("feats.json", 'feat')
 
 
 def srdfilter(data):
     for feat in data:
-        if feat['name'].lower() == 'grappler':
-            feat['srd'] = True
-        else:
-            feat['srd'] = False
-    return data
+        feat['srd'] = is_srd('feat', feat)
+        yield feat
 
 
 def dump(data):
-    with open('out/feats.json', 'w') as f:
-        json.dump(data, f, indent=4)
+    dump_json(data, 'out/feats.json')
 
 
 def run():
-    data = get_latest_feats()
-    data = srdfilter(data)
-    dump(data)
+    with Pipeline('feats'):
+        data = stage('fetch', get_latest_feats)
+        data = stage('srdfilter', srdfilter, data)
+        stage('dump', dump, data)
+    log_warning_summary()
 
 
 if __name__ == '__main__':
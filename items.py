@@ -1,18 +1,20 @@
-import json
+import itertools
 import logging
 
-from utils import get_data, render, recursive_tag
+from pipeline import Pipeline, stage
+from srdindex import is_srd
+from utils import dump_json, iter_data, log_render_cache_stats, log_warning_summary, render, run_incremental, tag_tree
 
 log = logging.getLogger("items")
 
 
 def get_latest_items():
-    return get_data("items.json")['item'] + get_data("basicitems.json")['basicitem'] + get_data("magicvariants.json")[
-        'variant']
+    return itertools.chain(iter_data("items.json", 'item'), iter_data("basicitems.json", 'basicitem'),
+                           iter_data("magicvariants.json", 'variant'))
 
 
 def moneyfilter(data):
-    return [i for i in data if not i.get('type') == "$"]
+    return (i for i in data if not i.get('type') == "$")
 
 
 def variant_inheritance(data):
@@ -25,11 +27,11 @@ def variant_inheritance(data):
             else:
                 item.update(item['inherits'])
             del item['inherits']  # avrae doesn't parse it anyway
-    return data
+        yield item
 
 
 def get_objects():
-    return get_data("objects.json")['object']
+    return iter_data("objects.json", 'object')
 
 
 def object_actions(objects):
@@ -42,50 +44,47 @@ def object_actions(objects):
 
 
 def srdfilter(data):
-    OVERRIDES = ('+1', '+2', '+3', 'giant strength', 'ioun stone', 'horn of valhalla', 'vorpal', 'of sharpness',
-                 'of answering', 'instrument of the bard', 'nine lives', 'frost brand', 'carpet of flying', 'vicious',
-                 'of wounding', 'of life stealing', 'of protection', 'adamantine', 'of wondrous power', 'luck blade')
-    TYPES = ('W', 'P', 'ST', 'RD', 'RG', 'WD')
-    with open('srd/srd-items.txt') as f:
-        srd = [s.strip().lower() for s in f.read().split('\n')]
-
     for item in data:
-        if item['name'].lower() in srd or any(i in item['name'].lower() for i in OVERRIDES) or not any(
-                i in item.get('type', '').split(',') for i in TYPES):
-            item['srd'] = True
-        else:
-            item['srd'] = False
-    return data
+        item['srd'] = is_srd('item', item)
+        yield item
 
 
 def prerender(data):
+    rewritten = 0
     for item in data:
-        if 'entries' in item:
-            item['desc'] = render(item['entries'])
-            del item['entries']
-        else:
-            item['desc'] = ""
-
-        for k, v in item.items():
-            item[k] = recursive_tag(v)
+        entries = item.pop('entries', None)
+        rewritten += tag_tree(item)  # desc is rendered already, so it is set after
+        item['desc'] = render(entries) if entries is not None else ""
+    log.info(f"Rendered tags in {rewritten} item fields")
     return data
 
 
 def dump(data):
-    with open('out/items.json', 'w') as f:
-        json.dump(data, f, indent=4)
+    dump_json(data, 'out/items.json')
+
+
+def process_items(data):
+    return stage('prerender', prerender, data)
+
+
+def process_objects(objects):
+    objects = stage('object_actions', object_actions, objects)
+    return stage('prerender_objects', prerender, objects)
 
 
 def run():
-    data = get_latest_items()
-    data = moneyfilter(data)
-    data = variant_inheritance(data)
-    objects = get_objects()
-    objects = object_actions(objects)
-    data.extend(objects)
-    data = srdfilter(data)
-    data = prerender(data)
-    dump(data)
+    with Pipeline('items'):
+        data = stage('fetch', get_latest_items)
+        data = stage('moneyfilter', moneyfilter, data)
+        data = stage('variant_inheritance', variant_inheritance, data)
+        data = stage('srdfilter', srdfilter, data)
+        data = stage('process', run_incremental, 'items', data, process_items)
+        objects = stage('fetch_objects', get_objects)
+        objects = stage('srdfilter_objects', srdfilter, objects)  # no object is renamed or retyped by object_actions
+        objects = stage('process_objects', run_incremental, 'objects', objects, process_objects)
+        stage('dump', dump, itertools.chain(data, objects))
+    log_render_cache_stats()
+    log_warning_summary()
 
 
 if __name__ == '__main__':
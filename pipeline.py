@@ -0,0 +1,160 @@
+import itertools
+import json
+import logging
+import operator
+import os
+import sys
+import time
+import tracemalloc
+
+PROFILE_MEMORY = "profile" in sys.argv  # tracemalloc slows the build down a lot, so memory is only traced on request
+
+log = logging.getLogger("pipeline")
+
+_current = None  # the pipeline running in this process, if any
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall = 0.
+        self.cpu = 0.
+        self.records = None
+        self.peak = None  # bytes
+
+    def to_dict(self):
+        return {'name': self.name, 'calls': self.calls, 'wall': round(self.wall, 6), 'cpu': round(self.cpu, 6),
+                'records': self.records, 'peak_kib': None if self.peak is None else round(self.peak / 1024, 1)}
+
+
+class Pipeline:
+    """Profiles the stages of one build. Each stage records its wall and CPU time, the number of records it produced
+    (or consumed, if it produces nothing) and, with the profile flag, the peak memory it allocated above where it started.
+    Time is only ever counted towards the innermost running stage: pulling a record through a streamed stage counts
+    towards that stage and not towards the one consuming it, and a stage run inside another is taken out of the outer
+    one. Stages run in worker processes by parallel_map are only seen as part of the stage that started the pool.
+    On exit, the report is written to out/<name>.profile.json."""
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = {}
+        self._active = []  # the stats of each running stage, innermost last
+        self._wall = self._cpu = 0.  # the clocks as of the last switch between stages
+        self._memory = None  # the memory traced as of the last switch
+        self._streams = {}  # id(generator) -> stats of the stage streaming it
+        self._start = None
+
+    def __enter__(self):
+        global _current
+        if PROFILE_MEMORY and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._start = (time.perf_counter(), time.process_time())
+        _current = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global _current
+        _current = None
+        if exc_type is None:
+            self.write_report()
+
+    def stage(self, name, func, *args):
+        """Runs func(*args) as a stage. If it returns a generator, the records are timed as they are pulled through.
+        :returns The result of func, or a generator over its records."""
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats(name)
+        stats.calls += 1
+        source = self._streams.get(id(args[0])) if args else None
+        consumed = None
+        if source is None and args and hasattr(args[0], '__next__'):
+            # an iterator the pipeline isn't timing, such as a chain of streams, is counted as it is consumed
+            consumed = itertools.count()
+            args = (map(operator.itemgetter(0), zip(args[0], consumed)),) + args[1:]
+        self._resume(stats)
+        try:
+            out = func(*args)
+        finally:
+            self._pause()
+        if hasattr(out, '__next__'):
+            return self._stream(stats, out)
+        if hasattr(out, '__len__'):
+            stats.records = (stats.records or 0) + len(out)
+        elif out is None and args:
+            if source is not None:
+                stats.records = source.records
+            elif consumed is not None:
+                stats.records = (stats.records or 0) + next(consumed)
+            elif hasattr(args[0], '__len__'):
+                stats.records = (stats.records or 0) + len(args[0])
+        return out
+
+    def _stream(self, stats, records):
+        stats.records = stats.records or 0
+        stream = self._pull(stats, records)
+        self._streams[id(stream)] = stats
+        return stream
+
+    def _pull(self, stats, records):
+        while True:
+            self._resume(stats)
+            try:
+                record = next(records)
+            except StopIteration:
+                return
+            finally:
+                self._pause()
+            stats.records += 1
+            yield record
+
+    def _resume(self, stats):
+        """Starts counting towards stats, pausing whichever stage was being counted."""
+        self._charge()
+        self._active.append(stats)
+
+    def _pause(self):
+        """Stops counting towards the innermost stage and goes back to counting towards the one it interrupted."""
+        self._charge()
+        self._active.pop()
+
+    def _charge(self):
+        """Counts the time since the last switch between stages towards the innermost running stage. The clocks are
+        read once per switch, since a streamed stage switches twice for every record."""
+        wall, cpu = time.perf_counter(), time.process_time()
+        if self._active:
+            stats = self._active[-1]
+            stats.wall += wall - self._wall
+            stats.cpu += cpu - self._cpu
+        self._wall, self._cpu = wall, cpu
+        if tracemalloc.is_tracing():
+            memory, peak = tracemalloc.get_traced_memory()
+            if self._active and self._memory is not None:
+                stats.peak = max(stats.peak or 0, peak - self._memory)
+            tracemalloc.reset_peak()
+            self._memory = memory
+
+    def report(self):
+        """:returns dict - The profile of the build so far."""
+        wall, cpu = self._start
+        return {'name': self.name, 'wall': round(time.perf_counter() - wall, 6),
+                'cpu': round(time.process_time() - cpu, 6), 'memory_traced': tracemalloc.is_tracing(),
+                'stages': [s.to_dict() for s in self.stages.values()]}
+
+    def write_report(self):
+        report = self.report()
+        for s in report['stages']:
+            log.info(f"{self.name}: {s['name']} took {s['wall']:.3f}s ({s['cpu']:.3f}s CPU) for {s['records']} records"
+                     + (f", peaking at {s['peak_kib']} KiB" if s['peak_kib'] is not None else ''))
+        path = f'out/{self.name}.profile.json'
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(report, f, indent=2)
+        os.replace(f'{path}.tmp', path)
+
+
+def stage(name, func, *args):
+    """Runs func(*args) as a stage of the pipeline running in this process, or just runs it if there is none.
+    :returns The result of func."""
+    if _current is None:
+        return func(*args)
+    return _current.stage(name, func, *args)
@@ -1,47 +1,52 @@
 import copy
+import functools
 import json
 import logging
+import os
 
-from utils import get_json
+from pipeline import Pipeline, stage
+from srdindex import is_srd
+from utils import DEBUG, Overlay, dump_json, get_json, iter_records, log_warning_summary, \
+    resolve_duplicates, run_incremental
 
-SRD = ['Dragonborn', 'Half-Elf', 'Half-Orc', 'Elf (High)', 'Dwarf (Hill)', 'Human', 'Human (Variant)',
-       'Halfling (Lightfoot)', 'Gnome (Rock)', 'Tiefling']
 SOURCE_HIERARCHY = ['MTF', 'VGM', 'PHB', 'DMG', 'UAWGtE', 'UA', 'nil']
+SOURCE_PRIORITY = {s: i for i, s in enumerate(SOURCE_HIERARCHY)}
 EXPLICIT_SOURCES = ['UAEberron', 'DMG']
 
 log = logging.getLogger("races")
 
 
 def get_races_from_web():
-    try:
-        with open('cache/races.json') as f:
-            races = json.load(f)
-            log.info("Loaded race data from cache")
-    except FileNotFoundError:
-        races = get_json('races.json')['race']
-        with open('cache/races.json', 'w') as f:
-            json.dump(races, f, indent=2)
+    if os.path.exists('cache/races.json'):
+        log.info("Loaded race data from cache")
+        return iter_records('cache/races.json')
+    races = get_json('races.json')['race']
+    with open('cache/races.json', 'w') as f:
+        json.dump(races, f, indent=2)
     return races
 
 
 def split_subraces(races):
     out = []
     for race in races:
-        log.info(f"Processing race {race['name']}")
+        if DEBUG:
+            log.debug(f"Processing race {race['name']}")
         if 'subraces' not in race:
             out.append(race)
         else:
             subraces = race['subraces']
             del race['subraces']
             for subrace in subraces:
-                log.info(f"Processing subrace {subrace.get('name')}")
-                new = copy.deepcopy(race)
+                if DEBUG:
+                    log.debug(f"Processing subrace {subrace.get('name')}")
+                new = Overlay(race)  # shares everything it doesn't override with the parent race
                 if 'name' in subrace:
                     new['name'] = f"{race['name']} ({subrace['name']})"
                 if 'entries' in subrace:
-                    new['entries'].extend(subrace['entries'])
+                    new['entries'] = race['entries'] + subrace['entries']
                 if 'ability' in subrace:
                     if 'ability' in new:
+                        new['ability'] = copy.copy(race['ability'])
                         new['ability'].update(subrace['ability'])
                     else:
                         new['ability'] = subrace['ability']
@@ -62,41 +67,40 @@ def explicit_sources(data):
     return data
 
 
+@functools.lru_cache(maxsize=None)
+def source_priority(source):
+    return SOURCE_PRIORITY[next((s for s in SOURCE_HIERARCHY if s in source), 'nil')]
+
+
 def fix_dupes(data):
-    for race in data:
-        if len([r for r in data if r['name'] == race['name']]) > 1:
-            log.warning(f"Found duplicate: {race['name']}")
-            hierarchied = sorted([r for r in data if r['name'] == race['name']],
-                                 key=lambda r: SOURCE_HIERARCHY.index(
-                                     next((s for s in SOURCE_HIERARCHY if s in r['source']), 'nil')))
-            for r in hierarchied[1:]:
-                new_name = f"{r['name']} ({r['source']})"
-                log.info(f"Renaming {r['name']} to {new_name}")
-                r['name'] = new_name
-    return data
+    return resolve_duplicates(data, rank=lambda r: source_priority(r['source']),
+                              rename=lambda r: f"{r['name']} ({r['source']})")
 
 
 def srdfilter(data):
     for race in data:
-        if race['name'] in SRD:
-            race['srd'] = True
-        else:
-            race['srd'] = False
-    return data
+        race['srd'] = is_srd('race', race)
+        yield race
 
 
 def dump(data):
-    with open('out/races.json', 'w') as f:
-        json.dump(data, f, indent=4)
+    dump_json(data, 'out/races.json')
+
+
+def process(races):
+    return [split_subraces([race]) for race in races]
 
 
 def run():
-    data = get_races_from_web()
-    data = split_subraces(data)
-    data = explicit_sources(data)
-    data = fix_dupes(data)
-    data = srdfilter(data)
-    dump(data)
+    with Pipeline('races'):
+        data = stage('fetch', get_races_from_web)
+        data = stage('process', run_incremental, 'races', data, process)
+        data = [subrace for subraces in data for subrace in subraces]
+        data = stage('explicit_sources', explicit_sources, data)
+        data = stage('fix_dupes', fix_dupes, data)
+        data = stage('srdfilter', srdfilter, data)
+        stage('dump', dump, data)
+    log_warning_summary()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,108 @@
+"""
+A record file holds a compendium output's records as compact JSON, each behind its length, followed by the offset of
+every record, so that it can be memory-mapped and single records decoded on demand instead of loading the whole list.
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+RECORD_MAGIC = b'AVRDREC1'
+RECORD_HEADER = struct.Struct('<8sQQ20s')  # magic, record count, index offset, sha1 of the records
+RECORD_LENGTH = struct.Struct('<I')
+RECORD_OFFSET = struct.Struct('<Q')
+
+
+class RecordWriter:
+    """Writes a record file: a header, then each record as compact JSON behind its length in bytes, then the offset of
+    each record, so a reader can find any record without reading the ones before it. The file is written to a
+    temporary path, checked against the hash of what was written, and only then renamed into place."""
+
+    def __init__(self, path, default=None):
+        """:param default: The json.dumps default hook records are serialized with."""
+        self.path = path
+        self.default = default
+        self.offsets = []
+        self._sha1 = hashlib.sha1()
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(f'{self.path}.tmp', 'wb')
+        self._file.write(bytes(RECORD_HEADER.size))  # filled in once the index has been written
+        return self
+
+    def write(self, record, text=None):
+        """:param text: The record already serialized as compact JSON, if it has been."""
+        if text is None:
+            text = json.dumps(record, separators=(',', ':'), default=self.default)
+        data = text.encode()
+        self.offsets.append(self._file.tell())
+        self._file.write(RECORD_LENGTH.pack(len(data)))
+        self._file.write(data)
+        self._sha1.update(data)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self._file.close()
+            return
+        index = self._file.tell()
+        for offset in self.offsets:
+            self._file.write(RECORD_OFFSET.pack(offset))
+        self._file.seek(0)
+        self._file.write(RECORD_HEADER.pack(RECORD_MAGIC, len(self.offsets), index, self._sha1.digest()))
+        self._file.close()
+        with RecordFile(f'{self.path}.tmp') as written:
+            written.verify()
+        os.replace(f'{self.path}.tmp', self.path)
+
+
+class RecordFile:
+    """A memory-mapped record file written by RecordWriter. Records are only decoded when they are indexed, so opening
+    even a large file is immediate.
+    :raises ValueError - If the file isn't a record file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count, self._index, self.sha1 = RECORD_HEADER.unpack_from(self._map)
+        if magic != RECORD_MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not a record file")
+
+    def __len__(self):
+        return self._count
+
+    def raw(self, i):
+        """:returns bytes - Record i as compact JSON."""
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        offset, = RECORD_OFFSET.unpack_from(self._map, self._index + i * RECORD_OFFSET.size)
+        length, = RECORD_LENGTH.unpack_from(self._map, offset)
+        start = offset + RECORD_LENGTH.size
+        return self._map[start:start + length]
+
+    def __getitem__(self, i):
+        return json.loads(self.raw(i if i >= 0 else i + self._count))
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+    def verify(self):
+        """Checks that the records found through the index hash to what was written.
+        :raises IOError - If they don't."""
+        sha1 = hashlib.sha1()
+        for i in range(self._count):
+            sha1.update(self.raw(i))
+        if sha1.digest() != self.sha1:
+            raise IOError("Record file does not match the records written to it")
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,122 @@
+import json
+import os
+import re
+
+INDEX_VERSION = 1
+NON_WORD_RE = re.compile(r'[^\w]+')
+
+
+def normalize(name):
+    """:returns str - The name lowercased, with punctuation dropped and whitespace collapsed."""
+    return ' '.join(NON_WORD_RE.sub(' ', name.lower()).split())
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class IndexWriter:
+    """Builds the search index of the records written to out/<name>.json, record by record, and writes it to path.
+    Records are numbered in the order they are written, which is their position in the JSON output and record file.
+    Trigrams are taken from the lowercased name, so that a substring query can be answered from the postings alone."""
+
+    def __init__(self, path):
+        self.path = path
+        self.names = []
+        self.sources = []
+        self.srd = []
+        self.exact = {}
+        self.tokens = {}
+        self.trigrams = {}
+
+    def __enter__(self):
+        return self
+
+    def add(self, record):
+        i = len(self.names)
+        name = str(record.get('name', '')).lower()
+        self.names.append(name)
+        self.sources.append(record.get('source'))
+        self.srd.append(bool(record.get('srd')))
+        self.exact.setdefault(name, []).append(i)
+        for token in set(normalize(name).split()):
+            self.tokens.setdefault(token, []).append(i)
+        for trigram in trigrams(name):
+            self.trigrams.setdefault(trigram, []).append(i)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            return
+        with open(f'{self.path}.tmp', 'w') as f:  # dumps, unlike dump, uses the C encoder
+            f.write(json.dumps({'version': INDEX_VERSION, 'names': self.names, 'sources': self.sources, 'srd': self.srd,
+                                'exact': self.exact, 'tokens': self.tokens, 'trigrams': self.trigrams},
+                               separators=(',', ':')))
+        os.replace(f'{self.path}.tmp', self.path)
+
+
+class SearchIndex:
+    """Answers name lookups from an index written by IndexWriter, without scanning the records.
+    Every query returns record positions, to index the list loaded from out/<name>.json or a RecordFile with.
+    :raises ValueError - If the index was written by an incompatible version."""
+
+    def __init__(self, data):
+        if data.get('version') != INDEX_VERSION:
+            raise ValueError(f"Unsupported search index version {data.get('version')}")
+        self.names = data['names']
+        self.sources = data['sources']
+        self.srd = data['srd']
+        self._exact = data['exact']
+        self._tokens = data['tokens']
+        self._trigrams = data['trigrams']
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def __len__(self):
+        return len(self.names)
+
+    def exact(self, name, source=None, srd_only=False):
+        """:returns list - The positions of the records named name, ignoring case, optionally only those from source."""
+        return [i for i in self._exact.get(name.lower(), [])
+                if (source is None or self.sources[i] == source) and (self.srd[i] or not srd_only)]
+
+    def containing(self, text, srd_only=False):
+        """:returns list - The positions of the records whose name contains text, ignoring case, in order."""
+        text = text.lower()
+        grams = trigrams(text)
+        if not grams:  # too short to have trigrams
+            candidates = range(len(self.names))
+        else:
+            postings = sorted((self._trigrams.get(g, []) for g in grams), key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+        return sorted(i for i in candidates if text in self.names[i] and (self.srd[i] or not srd_only))
+
+    def search(self, name, srd_only=False):
+        """Finds the record avrae's fuzzy_search would: the first one named name, ignoring case, or failing that the
+        first one whose name contains it.
+        :returns int - The position of the record, or None."""
+        found = self.exact(name, srd_only=srd_only) or self.containing(name, srd_only=srd_only)
+        return found[0] if found else None
+
+    def fuzzy(self, query, limit=5, srd_only=False):
+        """Ranks records by how many trigrams their names share with query, which tolerates typos, with records that
+        have every word of query first.
+        :returns list - Up to limit (score, position) tuples, best first, scores ranging from 0 to 1."""
+        query = query.lower()
+        grams = trigrams(query)
+        shared = {}
+        for g in grams:
+            for i in self._trigrams.get(g, []):
+                shared[i] = shared.get(i, 0) + 1
+        words = normalize(query).split()
+        with_words = set.intersection(*(set(self._tokens.get(w, [])) for w in words)) if words else set()
+        scored = []
+        for i, n in shared.items():
+            if srd_only and not self.srd[i]:
+                continue
+            score = 2 * n / (len(grams) + len(trigrams(self.names[i])))
+            scored.append((i in with_words, score, -i))
+        scored.sort(reverse=True)
+        return [(round(score, 4), -i) for _, score, i in scored[:limit]]
@@ -9,11 +9,11 @@ import random
 import re
 from math import floor
 
-import aiohttp
 import discord
 import html2text
 
 from cogs5e.models.errors import ExternalImportError
+from cogs5e.sheets.httpclient import CLIENT
 
 log = logging.getLogger(__name__)
 
@@ -67,16 +67,15 @@ class BeyondSheetParser:
     async def get_character(self):
         charId = self.url
         character = None
-        async with aiohttp.ClientSession(headers=CUSTOM_HEADERS) as session:
-            async with session.get(f"{API_BASE}{charId}/json") as resp:
-                log.debug(f"DDB returned {resp.status}")
-                if resp.status == 200:
-                    character = await resp.json()
-                elif resp.status == 404:
-                    raise ExternalImportError("Error: I do not have permission to view this character sheet. "
-                                              "Make sure you've generated a sharable link for your character.")
-                else:
-                    raise ExternalImportError(f"Beyond returned an error: {resp.status} - {resp.reason}")
+        async with CLIENT.get(f"{API_BASE}{charId}/json", headers=CUSTOM_HEADERS) as resp:
+            log.debug(f"DDB returned {resp.status}")
+            if resp.status == 200:
+                character = await resp.json()
+            elif resp.status == 404:
+                raise ExternalImportError("Error: I do not have permission to view this character sheet. "
+                                          "Make sure you've generated a sharable link for your character.")
+            else:
+                raise ExternalImportError(f"Beyond returned an error: {resp.status} - {resp.reason}")
         character['_id'] = charId
         self.character = character
         return character
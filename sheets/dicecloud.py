@@ -4,7 +4,8 @@ Created on Jan 19, 2017
 @author: andrew
 """
 import ast
-import asyncio
+import collections.abc
+import functools
 import logging
 import os
 import random
@@ -12,7 +13,6 @@ import re
 import sys
 from math import floor, ceil
 
-import aiohttp
 import discord
 import numexpr
 from simpleeval import SimpleEval, NameNotDefined, FunctionNotDefined
@@ -21,6 +21,7 @@ import credentials
 from cogs5e.funcs.lookupFuncs import c
 from cogs5e.models.dicecloudClient import DicecloudClient
 from cogs5e.models.errors import ExternalImportError
+from cogs5e.sheets.httpclient import CLIENT
 from utils.functions import fuzzy_search
 
 log = logging.getLogger(__name__)
@@ -31,36 +32,102 @@ CLASS_RESOURCE_NAMES = {"expertiseDice": "Expertise Dice", "ki": "Ki", "rages":
                         "sorceryPoints": "Sorcery Points", "superiorityDice": "Superiority Dice"}
 CLASS_RESOURCE_RESETS = {"expertiseDice": 'short', "ki": 'short', "rages": 'long',
                          "sorceryPoints": 'long', "superiorityDice": 'short'}
+STAT_OPERATIONS = ('base', 'add', 'mul', 'min', 'max')
+STAT_BASES = {'dexterityArmor': lambda names: names.get('dexterityMod', 0),
+              'proficiencyBonus': lambda names: floor(names.get('level', 0) / 4 + 1.75)}
+STAT_BASE_NAMES = {stat.lower(): stat for stat in STAT_BASES}
 API_BASE = "https://dicecloud.com/character/"
 KEY = credentials.dicecloud_token if not TESTING else credentials.test_dicecloud_token
 
 
+@functools.lru_cache(maxsize=4096)
+def parse_calculation(expr):
+    """Parses a calculation once, however many sheets and stats it shows up in.
+    :returns ast.expr - The parsed expression."""
+    return ast.parse(expr.strip()).body[0].value
+
+
+@functools.lru_cache(maxsize=4096)
+def calculation_names(expr):
+    """:returns frozenset - The lowercased names a calculation refers to, other than the functions it calls."""
+    node = parse_calculation(expr)
+    called = {id(n.func) for n in ast.walk(node) if isinstance(n, ast.Call)}
+    return frozenset(n.id.lower() for n in ast.walk(node) if isinstance(n, ast.Name) and id(n) not in called)
+
+
+def int_value(effect):
+    return int(effect.get('value', 0))
+
+
+def float_value(effect):
+    return float(effect.get('value', 0))
+
+
+class EffectTable:
+    """A character's enabled, non-removed effects, bucketed by the stat they affect, so a stat's effects are found
+    without scanning all of them. Each bucket keeps the order the effects are in on the sheet."""
+
+    def __init__(self, effects):
+        self.by_stat = {}
+        for effect in effects:
+            if effect.get('enabled', True) and not effect.get('removed', False):
+                self.by_stat.setdefault(effect.get('stat'), []).append(effect)
+
+    def get(self, stat):
+        return self.by_stat.get(stat, ())
+
+
+class IdIndex:
+    """The objects in a character's collections (spells, spellLists, features...) by their _id, so that an object is
+    found without scanning its collection. Each collection is indexed the first time it is looked in. Where ids repeat,
+    the first object with the id is the one found, as with a scan."""
+
+    def __init__(self, character):
+        self.character = character
+        self._collections = {}
+
+    def get(self, collection, _id):
+        """:returns dict - The object in collection with _id, or None."""
+        if collection not in self._collections:
+            objects = {}
+            for obj in self.character.get(collection, []):
+                objects.setdefault(obj.get('_id'), obj)
+            self._collections[collection] = objects
+        return self._collections[collection].get(_id)
+
+
 class DicecloudParser:
     def __init__(self, url):
         self.url = url
         self.character = None
         self.evaluator = DicecloudEvaluator()
+        self._effects = None
+        self._effects_of = None  # the character the effect table was built from
+        self._stat_values = {}  # (stat, base, value function) -> value
+        self._values_of = None  # the character the stat values were aggregated for
+        self._resolving = []  # the stats being aggregated, outermost first
+        self._ids = None
 
     async def get_character(self):
         url = self.url
         character = None
-        async with aiohttp.ClientSession() as session:
-            for _ in range(10):  # 10 retries
-                async with session.get(f"{API_BASE}{url}/json?key={KEY}") as resp:
-                    log.debug(f"Dicecloud returned {resp.status}")
-                    if resp.status == 200:
-                        character = await resp.json(encoding='utf-8')
-                        break
-                    elif resp.status == 429:
-                        timeout = await resp.json()
-                        log.info(f"Ratelimit hit getting character - resets in {timeout}ms")
-                        await asyncio.sleep(timeout['timeToReset'] / 1000)  # rate-limited, just wait
-                    elif resp.status == 403:
-                        raise ExternalImportError("Error: I do not have permission to view this character sheet. Make "
-                                                  "sure it's either shared with `avrae` on Dicecloud or set so "
-                                                  "anyone with link can view.")
-                    else:
-                        raise ExternalImportError(f"Dicecloud returned an error: {resp.status} - {resp.reason}")
+        for _ in range(10):  # 10 retries
+            async with CLIENT.get(f"{API_BASE}{url}/json?key={KEY}") as resp:
+                log.debug(f"Dicecloud returned {resp.status}")
+                if resp.status == 200:
+                    character = await resp.json(encoding='utf-8')
+                    break
+                elif resp.status == 429:
+                    timeout = await resp.json()
+                    log.info(f"Ratelimit hit getting character - resets in {timeout}ms")
+                    # rate-limited: hold back every import until it resets, this one's retry included
+                    CLIENT.pause(API_BASE, timeout['timeToReset'] / 1000)
+                elif resp.status == 403:
+                    raise ExternalImportError("Error: I do not have permission to view this character sheet. Make "
+                                              "sure it's either shared with `avrae` on Dicecloud or set so "
+                                              "anyone with link can view.")
+                else:
+                    raise ExternalImportError(f"Dicecloud returned an error: {resp.status} - {resp.reason}")
         character['_id'] = url
         self.character = character
         return character
@@ -213,59 +280,70 @@ class DicecloudParser:
 
         return embed
 
-    def get_stat(self, stat, base=0):
-        """Returns the stat value."""
+    @property
+    def effects(self):
+        """The effect table of the current character, built the first time it is needed."""
+        if self._effects is None or self._effects_of is not self.character:
+            self._effects = EffectTable(self.character.get('effects', []))
+            self._effects_of = self.character
+        return self._effects
+
+    @property
+    def ids(self):
+        """The _id index of the current character's collections."""
+        if self._ids is None or self._ids.character is not self.character:
+            self._ids = IdIndex(self.character)
+        return self._ids
+
+    def aggregate_stat(self, stat, base=0, value=None):
+        """Applies every effect on a stat to its base value: the highest base wins, then adds, multipliers, minimums
+        and maximums are applied, in that order.
+        Each stat is only aggregated once per character and base; the names its calculations use only ever gain
+        entries while a sheet is parsed, so the first result stays valid.
+        :param value: A function returning the value of an effect, or None to skip it. Defaults to effect_value.
+        :returns The stat value.
+        :raises ExternalImportError - If the stat's calculations depend on the stat itself."""
         if self.character is None: raise Exception('You must call get_character() first.')
-        character = self.character
-        effects = character.get('effects', [])
-        add = 0
-        mult = 1
-        maxV = None
-        minV = None
-        for effect in effects:
-            if effect.get('stat') == stat and effect.get('enabled', True) and not effect.get('removed', False):
-                operation = effect.get('operation', 'base')
-                value = int(effect.get('value', 0))
-                if operation == 'base' and value > base:
-                    base = value
-                elif operation == 'add':
-                    add += value
-                elif operation == 'mul':
-                    mult *= value
-                elif operation == 'min':
-                    minV = value if minV is None else value if value < minV else minV
-                elif operation == 'max':
-                    maxV = value if maxV is None else value if value > maxV else maxV
-        out = (base + add) * mult
-        if minV is not None:
-            out = max(out, minV)
-        if maxV is not None:
-            out = min(out, maxV)
+        value_of = value or self.effect_value
+        if self._values_of is not self.character:
+            self._stat_values = {}
+            self._values_of = self.character
+        key = (stat, base, value_of)
+        if key in self._stat_values:
+            return self._stat_values[key]
+        if stat in self._resolving:
+            cycle = ' -> '.join(self._resolving[self._resolving.index(stat):] + [stat])
+            raise ExternalImportError(f"Error: the calculations of these stats depend on each other: {cycle}")
+        self._resolving.append(stat)
+        try:
+            out = self._aggregate(stat, base, value_of)
+        finally:
+            self._resolving.pop()
+        self._stat_values[key] = out
         return out
 
-    def get_stat_float(self, stat, base=0):
-        """Returns the stat value."""
-        if self.character is None: raise Exception('You must call get_character() first.')
-        character = self.character
-        effects = character.get('effects', [])
+    def _aggregate(self, stat, base, value_of):
         add = 0
         mult = 1
         maxV = None
         minV = None
-        for effect in effects:
-            if effect.get('stat') == stat and effect.get('enabled', True) and not effect.get('removed', False):
-                operation = effect.get('operation', 'base')
-                value = float(effect.get('value', 0))
-                if operation == 'base' and value > base:
-                    base = value
-                elif operation == 'add':
-                    add += value
-                elif operation == 'mul':
-                    mult *= value
-                elif operation == 'min':
-                    minV = value if minV is None else value if value < minV else minV
-                elif operation == 'max':
-                    maxV = value if maxV is None else value if value > maxV else maxV
+        for effect in self.effects.get(stat):
+            operation = effect.get('operation', 'base')
+            if operation not in STAT_OPERATIONS:
+                continue
+            value = value_of(effect)
+            if value is None:
+                continue
+            if operation == 'base' and value > base:
+                base = value
+            elif operation == 'add':
+                add += value
+            elif operation == 'mul':
+                mult *= value
+            elif operation == 'min':
+                minV = value if minV is None else value if value < minV else minV
+            elif operation == 'max':
+                maxV = value if maxV is None else value if value > maxV else maxV
         out = (base + add) * mult
         if minV is not None:
             out = max(out, minV)
@@ -273,6 +351,46 @@ class DicecloudParser:
             out = min(out, maxV)
         return out
 
+    def effect_value(self, effect):
+        """Returns the value an effect sets, or else the result of its calculation, or None if it has neither."""
+        if effect.get('value') is not None:
+            return effect.get('value')
+        calculation = effect.get('calculation', '').replace('{', '').replace('}', '').strip()
+        if not calculation:
+            return None
+        try:
+            resolved = self.resolve_names(calculation)
+        except SyntaxError:
+            return None
+        self.evaluator.names.push(resolved)
+        try:
+            return self.evaluator.eval(calculation)
+        except SyntaxError:
+            return None
+        finally:
+            self.evaluator.names.pop()
+
+    def resolve_names(self, calculation):
+        """Works out the stats a calculation refers to that have not been worked out yet, in dependency order, so that
+        it can be evaluated. Only stats with a base in STAT_BASES are worked out; other names that aren't known yet
+        are left for eval to reject.
+        :returns dict - The values of the stats worked out, to evaluate the calculation with."""
+        resolved = {}
+        for name in calculation_names(calculation):
+            stat = STAT_BASE_NAMES.get(name)
+            if stat is None or self.evaluator.has_name(name):
+                continue
+            resolved[stat] = self.aggregate_stat(stat, STAT_BASES[stat](self.evaluator.names))
+        return resolved
+
+    def get_stat(self, stat, base=0):
+        """Returns the stat value, from the effects' values alone."""
+        return self.aggregate_stat(stat, base, int_value)
+
+    def get_stat_float(self, stat, base=0):
+        """Returns the stat value, from the effects' values alone, as a float."""
+        return self.aggregate_stat(stat, base, float_value)
+
     def get_stats(self):
         """Returns a dict of stats."""
         if self.character is None: raise Exception('You must call get_character() first.')
@@ -311,46 +429,8 @@ class DicecloudParser:
         return levels
 
     def calculate_stat(self, stat, base=0):
-        """Calculates and returns the stat value."""
-        if self.character is None: raise Exception('You must call get_character() first.')
-        character = self.character
-        effects = character.get('effects', [])
-        add = 0
-        mult = 1
-        maxV = None
-        minV = None
-        for effect in effects:
-            if effect.get('stat') == stat and effect.get('enabled', True) and not effect.get('removed', False):
-                operation = effect.get('operation', 'base')
-                if operation not in ('base', 'add', 'mul', 'min', 'max'):
-                    continue
-                if effect.get('value') is not None:
-                    value = effect.get('value')
-                else:
-                    calculation = effect.get('calculation', '').replace('{', '').replace('}', '').strip()
-                    if not calculation: continue
-                    try:
-                        value = self.evaluator.eval(calculation)
-                    except SyntaxError:
-                        continue
-                    except KeyError:
-                        raise
-                if operation == 'base' and value > base:
-                    base = value
-                elif operation == 'add':
-                    add += value
-                elif operation == 'mul':
-                    mult *= value
-                elif operation == 'min':
-                    minV = value if minV is None else value if value < minV else minV
-                elif operation == 'max':
-                    maxV = value if maxV is None else value if value > maxV else maxV
-        out = (base + add) * mult
-        if minV is not None:
-            out = max(out, minV)
-        if maxV is not None:
-            out = min(out, maxV)
-        return out
+        """Calculates and returns the stat value, evaluating the calculations of effects without a value."""
+        return self.aggregate_stat(stat, base)
 
     def get_attack(self, atkIn):
         """Calculates and returns a dict."""
@@ -360,28 +440,18 @@ class DicecloudParser:
 
         temp_names = {}
         if atkIn.get('parent', {}).get('collection') == 'Spells':
-            spellParentID = atkIn.get('parent', {}).get('id')
-            try:
-                spellObj = next(s for s in self.character.get('spells', {}) if s.get('_id') == spellParentID)
-            except StopIteration:
-                pass
-            else:
-                spellListParentID = spellObj.get('parent', {}).get('id')
+            spellObj = self.ids.get('spells', atkIn.get('parent', {}).get('id'))
+            spellListObj = None if spellObj is None else \
+                self.ids.get('spellLists', spellObj.get('parent', {}).get('id'))
+            if spellListObj is not None:
                 try:
-                    spellListObj = next(
-                        s for s in self.character.get('spellLists', {}) if s.get('_id') == spellListParentID)
-                except StopIteration:
-                    pass
-                else:
-                    try:
-                        temp_names['attackBonus'] = int(
-                            self.evaluator.eval(spellListObj.get('attackBonus')))
-                        temp_names['DC'] = int(self.evaluator.eval(spellListObj.get('saveDC')))
-                    except Exception as e:
-                        log.debug(f"Exception parsing spellvars: {e}")
-
-        old_names = self.evaluator.names.copy()
-        self.evaluator.names.update(temp_names)
+                    temp_names['attackBonus'] = int(
+                        self.evaluator.eval(spellListObj.get('attackBonus')))
+                    temp_names['DC'] = int(self.evaluator.eval(spellListObj.get('saveDC')))
+                except Exception as e:
+                    log.debug(f"Exception parsing spellvars: {e}")
+
+        self.evaluator.names.push(temp_names)
         log.debug(f"evaluator tempnames: {temp_names}")
         attack = {'attackBonus': atkIn.get('attackBonus', '').replace('{', '').replace('}', ''), 'damage': '0',
                   'name': atkIn.get('name'), 'details': None}
@@ -416,7 +486,7 @@ class DicecloudParser:
             details = re.sub(r'{([^{}]*)}', damage_sub, details)
             attack['details'] = details
 
-        self.evaluator.names = old_names
+        self.evaluator.names.pop()
 
         return attack
 
@@ -425,14 +495,19 @@ class DicecloudParser:
         if self.character is None: raise Exception('You must call get_character() first.')
         character = self.character
         attacks = []
+        used_names = set()
+        next_num = {}  # name -> the number to try next when another attack has it
         for attack in character.get('attacks', []):
             if attack.get('enabled') and not attack.get('removed'):
                 atkDict = self.get_attack(attack)
-                atkNum = 2
-                if atkDict['name'] in (a['name'] for a in attacks):
-                    while atkDict['name'] + str(atkNum) in (a['name'] for a in attacks):
+                name = atkDict['name']
+                if name in used_names:
+                    atkNum = next_num.get(name, 2)
+                    while name + str(atkNum) in used_names:
                         atkNum += 1
-                    atkDict['name'] = atkDict['name'] + str(atkNum)
+                    next_num[name] = atkNum + 1
+                    atkDict['name'] = name + str(atkNum)
+                used_names.add(atkDict['name'])
                 attacks.append(atkDict)
         return attacks
 
@@ -492,11 +567,10 @@ class DicecloudParser:
 
         _effects = {}
 
-        effects = self.character.get('effects', [])
-        for effect in effects:
-            if effect.get('stat') in skillslist and effect.get('enabled', True) and not effect.get('removed', False):
-                statname = effect.get('stat')
-                if not statname in _effects: _effects[statname] = []
+        for statname, effects in self.effects.by_stat.items():
+            if statname not in skillslist: continue
+            _effects[statname] = []
+            for effect in effects:
                 if effect.get('operation') == 'disadvantage':
                     _effects[statname].append('dis')
                 if effect.get('operation') == 'advantage':
@@ -583,6 +657,72 @@ class DicecloudParser:
         return counters
 
 
+class NameTable(collections.abc.MutableMapping):
+    """The evaluator's names, in layers: the character's names at the bottom, and on top of them a scope for each set
+    of names pushed, such as an attack's spell variables, which shadow the names below until it is popped.
+    Every layer keeps an index of its names by their lowercased form, updated as names are set, so that a name is
+    looked up ignoring case without going through all of them. Where names in a layer only differ in case, the one
+    added last is found, and a name is found in the topmost layer that has it."""
+
+    def __init__(self, names=None):
+        self._layers = [{}]
+        self._indexes = [{}]  # lowercased name -> name, for each layer
+        if names:
+            self.update(names)
+
+    def __getitem__(self, key):
+        for layer in reversed(self._layers):
+            if key in layer:
+                return layer[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        layer = self._layers[-1]
+        if key not in layer:
+            self._indexes[-1][key.lower()] = key
+        layer[key] = value
+
+    def __delitem__(self, key):
+        layer, index = self._layers[-1], self._indexes[-1]
+        del layer[key]
+        if index.get(key.lower()) == key:
+            del index[key.lower()]
+            for other in layer:  # another name that differs in case takes its place, if there is one
+                if other.lower() == key.lower():
+                    index[key.lower()] = other
+
+    def __iter__(self):
+        return iter(collections.ChainMap(*reversed(self._layers)))
+
+    def __len__(self):
+        return len(collections.ChainMap(*self._layers))
+
+    def lookup(self, name):
+        """:returns The value of name, ignoring case.
+        :raises KeyError - If no layer has the name."""
+        lower = name.lower()
+        for layer, index in zip(reversed(self._layers), reversed(self._indexes)):
+            if lower in index:
+                return layer[index[lower]]
+        raise KeyError(name)
+
+    def push(self, names):
+        """Starts a scope holding names, which shadow the names already set until it is popped."""
+        self._layers.append({})
+        self._indexes.append({})
+        self.update(names)
+
+    def pop(self):
+        """Drops the last scope pushed, and any names set since."""
+        if len(self._layers) == 1:
+            raise IndexError("pop from a name table without scopes")
+        self._indexes.pop()
+        return self._layers.pop()
+
+    def copy(self):
+        return NameTable(self)
+
+
 class DicecloudEvaluator(SimpleEval):
     DEFAULT_FUNCTIONS = {'ceil': ceil, 'floor': floor, 'max': max, 'min': min, 'round': round}
 
@@ -591,10 +731,30 @@ class DicecloudEvaluator(SimpleEval):
             functions = self.DEFAULT_FUNCTIONS
         super(DicecloudEvaluator, self).__init__(operators, functions, names)
 
+    @property
+    def names(self):
+        return self._names
+
+    @names.setter
+    def names(self, names):
+        self._names = names if isinstance(names, NameTable) else NameTable(names)
+
+    def eval(self, expr):
+        """Evaluates an expression, reusing its parsed form if it has been parsed before."""
+        self.expr = expr
+        return self._eval(parse_calculation(expr))
+
+    def has_name(self, name):
+        """Returns whether a name is defined, ignoring case."""
+        try:
+            self.names.lookup(name)
+        except KeyError:
+            return False
+        return True
+
     def _eval_name(self, node):
-        lowernames = {k.lower(): v for k, v in self.names.items()}
         try:
-            return lowernames[node.id.lower()]
+            return self.names.lookup(node.id)
         except KeyError:
             if node.id in self.functions:
                 return self.functions[node.id]
@@ -0,0 +1,209 @@
+"""
+A long-lived HTTP client shared by the sheet parsers, so that imports reuse pooled keep-alive connections instead of
+opening a session (and paying for DNS and TLS) each, and so that every import going to a provider shares one rate
+limit and concurrency limit for it.
+"""
+import asyncio
+import collections
+import logging
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+log = logging.getLogger(__name__)
+
+POOL_SIZE = 100  # connections kept open across all hosts
+KEEPALIVE_TIMEOUT = 30  # seconds an idle connection is kept
+DNS_CACHE_TTL = 300
+LATENCY_SAMPLES = 200  # latencies kept per host for the percentiles
+
+
+class HostLimit(collections.namedtuple('HostLimit', 'concurrency rate burst')):
+    """How hard a host may be hit: at most concurrency requests in flight, and rate requests a second on average, with
+    bursts of up to burst requests."""
+
+
+DEFAULT_LIMIT = HostLimit(concurrency=4, rate=5, burst=10)
+HOST_LIMITS = {'dicecloud.com': HostLimit(concurrency=4, rate=4, burst=8),
+               'www.dndbeyond.com': HostLimit(concurrency=4, rate=5, burst=10)}
+
+
+class TokenBucket:
+    """Hands out rate tokens a second, up to capacity at once. While paused (say, until a provider's rate limit
+    resets) it hands out none, and it starts again empty, so the requests held back don't all go out at once."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+
+    def pause(self, seconds):
+        resume = time.monotonic() + seconds
+        if resume > self.paused_until:
+            self.paused_until = resume
+            self.tokens = 0
+            self.updated = resume
+
+    async def acquire(self):
+        """Waits for a token and takes it.
+        :returns float - How long it waited."""
+        start = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return now - start
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class HostStats:
+    """Request counts and latencies for one host."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0  # responses with an error status, and requests that failed outright
+        self.ratelimited = 0
+        self.in_flight = 0
+        self.waited = 0  # total seconds spent waiting for the rate limit
+        self.latency = 0  # total seconds until response headers
+        self.max_latency = 0
+        self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+
+    def record(self, latency, status=None):
+        self.requests += 1
+        if status is None or status >= 400:
+            self.errors += 1
+        if status == 429:
+            self.ratelimited += 1
+        self.latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.latencies.append(latency)
+
+    def percentile(self, p):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))], 4)
+
+    def to_dict(self):
+        return {'requests': self.requests, 'errors': self.errors, 'ratelimited': self.ratelimited,
+                'in_flight': self.in_flight, 'waited': round(self.waited, 3),
+                'mean_latency': round(self.latency / self.requests, 4) if self.requests else None,
+                'p50_latency': self.percentile(0.5), 'p95_latency': self.percentile(0.95),
+                'max_latency': round(self.max_latency, 4)}
+
+
+class Host:
+    def __init__(self, limit):
+        self.limit = limit
+        self.bucket = TokenBucket(limit.rate, limit.burst)
+        self.stats = HostStats()
+        self.semaphore = None  # made on the event loop it's used on
+
+
+class SheetClient:
+    """One pooled aiohttp session, made the first time it's needed on the running event loop, with a rate limit and a
+    concurrency limit per host (see HOST_LIMITS; hosts are matched on the URL's host[:port]).
+    Use as `async with client.get(url) as resp:`, like an aiohttp session."""
+
+    def __init__(self, limits=None, default_limit=DEFAULT_LIMIT):
+        self.limits = HOST_LIMITS if limits is None else limits
+        self.default_limit = default_limit
+        self.hosts = {}
+        self._session = None
+        self._loop = None
+
+    async def get_session(self):
+        """:returns aiohttp.ClientSession - The pooled session for the running event loop. A session made on another
+        loop can't be used on this one, so it's closed (releasing its connections) and replaced."""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            await self.close()
+            connector = aiohttp.TCPConnector(limit=POOL_SIZE, keepalive_timeout=KEEPALIVE_TIMEOUT,
+                                             ttl_dns_cache=DNS_CACHE_TTL)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._loop = loop
+            for host in self.hosts.values():  # semaphores belong to the loop they were made on
+                host.semaphore = None
+        return self._session
+
+    def host(self, url):
+        netloc = urlsplit(url).netloc
+        if netloc not in self.hosts:
+            self.hosts[netloc] = Host(self.limits.get(netloc, self.default_limit))
+        return self.hosts[netloc]
+
+    def get(self, url, **kwargs):
+        return Request(self, 'GET', url, kwargs)
+
+    def pause(self, url, seconds):
+        """Holds back every request to url's host for seconds, such as until a rate limit the host reports resets."""
+        log.info(f"Pausing requests to {urlsplit(url).netloc} for {seconds:.1f}s")
+        self.host(url).bucket.pause(seconds)
+
+    def metrics(self):
+        """:returns dict - The request counts and latencies (in seconds) of every host requested so far."""
+        return {netloc: host.stats.to_dict() for netloc, host in self.hosts.items()}
+
+    async def close(self):
+        """Closes the session and its pooled connections. Await it when shutting down; the next request opens a new
+        session."""
+        session, self._session, self._loop = self._session, None, None
+        if session is None or session.closed:
+            return
+        try:
+            await session.close()
+        except RuntimeError as e:  # its connections belong to a loop that has since been closed
+            log.debug(f"Closed a session left on a closed event loop: {e}")
+
+
+class Request:
+    """A request made through a SheetClient: waits for its host's concurrency and rate limits, then sends it on the
+    shared session, recording how long the response took."""
+
+    def __init__(self, client, method, url, kwargs):
+        self.client = client
+        self.method = method
+        self.url = url
+        self.kwargs = kwargs
+        self.host = client.host(url)
+        self._semaphore = None
+        self._response = None
+
+    async def __aenter__(self):
+        session = await self.client.get_session()
+        if self.host.semaphore is None:
+            self.host.semaphore = asyncio.Semaphore(self.host.limit.concurrency)
+        self._semaphore = self.host.semaphore
+        await self._semaphore.acquire()
+        try:
+            self.host.stats.waited += await self.host.bucket.acquire()
+            self.host.stats.in_flight += 1
+            start = time.perf_counter()
+            try:
+                self._response = await session.request(self.method, self.url, **self.kwargs)
+            except Exception:
+                self.host.stats.in_flight -= 1
+                self.host.stats.record(time.perf_counter() - start)
+                raise
+            self.host.stats.record(time.perf_counter() - start, self._response.status)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        return self._response
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._response.release()
+        self.host.stats.in_flight -= 1
+        self._semaphore.release()
+
+
+CLIENT = SheetClient()
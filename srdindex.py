@@ -0,0 +1,50 @@
+"""
+Membership index of the content released in the SRD, shared by the srdfilter of every data type.
+"""
+import functools
+import re
+
+MONSTER_LIST = 'srd/srd-monsters.txt'
+ITEM_LIST = 'srd/srd-items.txt'
+ITEM_OVERRIDES = ('+1', '+2', '+3', 'giant strength', 'ioun stone', 'horn of valhalla', 'vorpal', 'of sharpness',
+                  'of answering', 'instrument of the bard', 'nine lives', 'frost brand', 'carpet of flying', 'vicious',
+                  'of wounding', 'of life stealing', 'of protection', 'adamantine', 'of wondrous power', 'luck blade')
+ITEM_OVERRIDE_RE = re.compile('|'.join(re.escape(o) for o in ITEM_OVERRIDES))
+ITEM_TYPES = frozenset(('W', 'P', 'ST', 'RD', 'RG', 'WD'))  # items of any other type are always in the SRD
+RACES = frozenset(r.lower() for r in ('Dragonborn', 'Half-Elf', 'Half-Orc', 'Elf (High)', 'Dwarf (Hill)', 'Human',
+                                      'Human (Variant)', 'Halfling (Lightfoot)', 'Gnome (Rock)', 'Tiefling'))
+FEATS = frozenset(('grappler',))
+
+
+@functools.lru_cache(maxsize=None)
+def load(path):
+    """Reads an SRD list once.
+    :returns frozenset - The lowercased names in the list."""
+    with open(path) as f:
+        return frozenset(s.strip().lower() for s in f.read().split('\n'))
+
+
+def srd_monster(monster):
+    return monster['name'].lower() in load(MONSTER_LIST)
+
+
+def srd_item(item):
+    name = item['name'].lower()
+    return name in load(ITEM_LIST) or ITEM_OVERRIDE_RE.search(name) is not None or \
+        ITEM_TYPES.isdisjoint(item.get('type', '').split(','))
+
+
+def srd_race(race):
+    return race['name'].lower() in RACES
+
+
+def srd_feat(feat):
+    return feat['name'].lower() in FEATS
+
+
+LOOKUPS = {'monster': srd_monster, 'item': srd_item, 'race': srd_race, 'feat': srd_feat}
+
+
+def is_srd(kind, record):
+    """Returns whether a record of a kind (monster, item, race or feat) is in the SRD."""
+    return LOOKUPS[kind](record)
@@ -1,12 +1,43 @@
+import bisect
+import collections
+import contextlib
+import functools
+import glob
+import hashlib
+import itertools
 import json
 import logging
+import os
 import re
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
 
-DATA_SRC = "https://5etools.com/data/"
+from recordfile import RecordWriter
+from searchindex import IndexWriter
+
+DATA_SRC = os.environ.get("DATA_SRC", "https://5etools.com/data/")  # point at a local server to build from fixtures
+FETCH_WORKERS = 8
+FETCH_RETRIES = 3
+FETCH_BACKOFF = 0.5  # seconds, doubled after each failed attempt
+FETCH_TIMEOUT = 30
 LOGLEVEL = logging.INFO if not "debug" in sys.argv else logging.DEBUG
+DEBUG = LOGLEVEL <= logging.DEBUG  # guards debug messages, so they aren't formatted unless they'll be logged
+PROGRESS_INTERVAL = 5  # seconds between progress reports
+OFFLINE = "offline" in sys.argv  # use cached sources as-is instead of revalidating them
+MANIFEST = 'cache/manifest.json'
+FULL_BUILD = "--full" in sys.argv  # reprocess every record instead of reusing unchanged outputs
+WORKERS = next((int(a.split('=', 1)[1]) for a in sys.argv if a.startswith('--workers=')), 1)
+CHUNKS_PER_WORKER = 4
+INCREMENTAL_BATCH = 1000  # records run_incremental holds at a time
+DUMP_FORMAT = 'ndjson' if "--ndjson" in sys.argv else 'compact' if "--compact" in sys.argv else 'pretty'
+RECORD_FILES = "--records" in sys.argv  # also write each output as a record file (see recordfile.RecordFile)
+SEARCH_INDEX = "--search-index" in sys.argv  # also index each output by name (see searchindex.SearchIndex)
+RENDER_CACHE_SIZE = 8192
+JSON_CHUNK_SIZE = 1 << 16
 
 log_formatter = logging.Formatter('%(levelname)s:%(name)s: %(message)s')
 handler = logging.StreamHandler(sys.stdout)
@@ -17,9 +48,158 @@ logger.addHandler(handler)
 log = logging.getLogger(__name__)
 
 
-def get_json(path):
+class Progress:
+    """Iterates over records, logging how many have been through at most once every PROGRESS_INTERVAL seconds, and
+    once more at the end, instead of once per record."""
+
+    def __init__(self, label, records, logger=None):
+        self.label = label
+        self.records = records
+        self.total = len(records) if hasattr(records, '__len__') else None
+        self.log = logger or log
+        self.count = 0
+
+    def __iter__(self):
+        last = time.monotonic()
+        for record in self.records:
+            yield record
+            self.count += 1
+            now = time.monotonic()
+            if now - last >= PROGRESS_INTERVAL:
+                last = now
+                self.log.info(f"{self.label}: {self}")
+        self.log.info(f"{self.label}: {self}, done")
+
+    def __str__(self):
+        return f"{self.count}/{self.total}" if self.total is not None else str(self.count)
+
+
+WARNINGS = collections.Counter()
+_deferred = None  # while the render cache renders a string, the warnings raised, to be replayed on every lookup of it
+
+
+def warn(message, logger=None):
+    """Logs a warning the first time it comes up and only counts it after that; log_warning_summary reports the
+    counts. Messages should name the kind of problem rather than the record it was found in, so repeats add up."""
+    if _deferred is not None:
+        _deferred.append((message, logger))
+        return
+    WARNINGS[message] += 1
+    if WARNINGS[message] == 1:
+        (logger or log).warning(message)
+
+
+def log_warning_summary():
+    for message, count in WARNINGS.most_common():
+        if count > 1:
+            log.warning(f"{message} ×{count}")
+    WARNINGS.clear()
+
+
+_session = None
+
+
+def get_session():
+    """Returns the keep-alive HTTP session shared by every fetch, with a connection pool sized for FETCH_WORKERS."""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=FETCH_WORKERS, pool_maxsize=FETCH_WORKERS)
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+    return _session
+
+
+def fetch(path, headers=None):
+    """GETs a file from DATA_SRC, retrying connection errors, timeouts and server errors with backoff.
+    :returns requests.Response - The response."""
     log.info(f"Getting {path}...")
-    return requests.get(DATA_SRC + path).json()
+    for attempt in range(FETCH_RETRIES + 1):
+        try:
+            resp = get_session().get(DATA_SRC + path, headers=headers, timeout=FETCH_TIMEOUT)
+            if resp.status_code < 500:
+                return resp
+            error = f"{resp.status_code} - {resp.reason}"
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+        if attempt == FETCH_RETRIES:
+            raise IOError(f"Failed to get {path} after {attempt + 1} attempts: {error}")
+        delay = FETCH_BACKOFF * 2 ** attempt
+        log.warning(f"Failed to get {path} ({error}), retrying in {delay}s")
+        time.sleep(delay)
+
+
+def get_json(path):
+    return fetch(path).json()
+
+
+def get_sources(paths, key=None, workers=FETCH_WORKERS):
+    """Fetches several files concurrently, keeping each one in its own cache file.
+    The ETag, Last-Modified and content hash of every cached file are recorded in the manifest, so an unchanged file is
+    only revalidated with a conditional request and then loaded from the cache.
+    :param key: If given, each file is streamed from the cache as an iterator over the records in this array.
+    :returns list - The parsed files, in the same order as paths."""
+    try:
+        with open(MANIFEST) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda path: get_source(path, manifest.get(path), key), paths))
+
+    changed = False
+    for path, (data, meta) in zip(paths, results):
+        if meta != manifest.get(path):
+            manifest[path] = meta
+            changed = True
+    if changed:
+        with open(f'{MANIFEST}.tmp', 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(f'{MANIFEST}.tmp', MANIFEST)
+    return [data for data, meta in results]
+
+
+def get_source(path, meta, key=None):
+    """Loads a single file for get_sources().
+    :returns tuple - The parsed file and its manifest entry."""
+    cached = f'cache/{path}'
+    headers = {}
+    if meta is not None and os.path.exists(cached):
+        if OFFLINE:
+            return load_cached(path, key), meta
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+    else:
+        meta = {}
+
+    resp = fetch(path, headers)
+    if resp.status_code == 304:
+        return load_cached(path, key), meta
+    if not resp.ok:
+        raise IOError(f"Failed to get {path}: {resp.status_code} - {resp.reason}")
+
+    body = resp.content
+    new_meta = {'etag': resp.headers.get('ETag'), 'last_modified': resp.headers.get('Last-Modified'),
+                'sha1': hashlib.sha1(body).hexdigest()}
+    if new_meta['sha1'] != meta.get('sha1'):
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        with open(cached, 'wb') as f:
+            f.write(body)
+        log.info(f"Updated cached {path}")
+    if key is not None:
+        return iter_records(cached, key), new_meta
+    return json.loads(body), new_meta
+
+
+def load_cached(path, key=None):
+    log.info(f"Loaded {path} from cache")
+    if key is not None:
+        return iter_records(f'cache/{path}', key)
+    with open(f'cache/{path}') as f:
+        return json.load(f)
 
 
 def get_data(path):
@@ -34,6 +214,303 @@ def get_data(path):
     return dat
 
 
+def iter_data(path, key):
+    """Yields the records under key in a cached file one at a time, fetching the file into the cache first if needed."""
+    if not os.path.exists(f'cache/{path}'):
+        get_data(path)
+    else:
+        log.info(f"Loaded {path} from cache")
+    yield from iter_records(f'cache/{path}', key)
+
+
+WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+NUMBER_TAIL_RE = re.compile(r'[\d.eE+-]*\Z')
+JSON_DECODER = json.JSONDecoder()
+
+
+class JSONStream:
+    """A minimal incremental JSON reader, which decodes one value at a time from a buffer refilled from a file."""
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ''
+        self.pos = 0
+
+    def fill(self):
+        """Reads more of the file into the buffer, dropping what has already been consumed.
+        :returns bool - Whether anything was read."""
+        chunk = self.f.read(max(JSON_CHUNK_SIZE, len(self.buf) - self.pos))  # doubles the buffer for large values
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return bool(chunk)
+
+    def peek(self):
+        """Skips whitespace and returns the next character, or '' at the end of the file."""
+        while True:
+            self.pos = WHITESPACE_RE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} in {self.f.name}, found {self.peek()!r}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = JSON_DECODER.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            if isinstance(value, (int, float)) and NUMBER_TAIL_RE.match(self.buf, end) and self.fill():
+                continue  # the number may go on past the end of the buffer
+            self.pos = end
+            return value
+
+
+def iter_records(path, key=None):
+    """Yields the values of a JSON array one at a time, without loading the whole file.
+    :param key: The top-level key of the array, or None if the file is the array itself."""
+    with open(path) as f:
+        stream = JSONStream(f)
+        if key is not None:
+            stream.expect('{')
+            while stream.peek() != '}':
+                name = stream.value()
+                stream.expect(':')
+                if name == key:
+                    break
+                stream.value()
+                if stream.peek() == ',':
+                    stream.pos += 1
+            else:
+                raise KeyError(key)
+        stream.expect('[')
+        while stream.peek() != ']':
+            yield stream.value()
+            if stream.peek() == ',':
+                stream.pos += 1
+
+
+def record_key(record):
+    """Fingerprints an input record by name, source and a hash of its content."""
+    digest = hashlib.sha1(json.dumps(record, sort_keys=True).encode()).hexdigest()
+    return f"{record.get('name')}|{record.get('source')}|{digest}"
+
+
+def code_version():
+    """Hashes the build scripts and SRD lists, so that stored outputs are dropped when either changes."""
+    digest = hashlib.sha1()
+    root = os.path.dirname(os.path.abspath(__file__))
+    for path in sorted(glob.glob(os.path.join(root, '*.py'))) + sorted(glob.glob('srd/*.txt')):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def index_store(path, version):
+    """Finds the outputs stored by the last build of the same version, without loading them.
+    :returns dict - The offset of each stored output's line in the store, by record key."""
+    offsets = {}
+    try:
+        with open(path, 'rb') as f:
+            try:
+                if json.loads(f.readline()).get('version') != version:
+                    return {}
+            except ValueError:
+                return {}
+            offset = f.tell()
+            for line in f:
+                offsets[json.loads(line[:line.index(b'\t')])] = offset
+                offset += len(line)
+    except FileNotFoundError:
+        pass
+    return offsets
+
+
+def run_incremental(name, records, process):
+    """Runs process over only the records that are new or changed since the last build, reusing the stored outputs for
+    the rest. process must map a list of records to a list of outputs, one per record and in the same order, without
+    looking at any other record. Records are fingerprinted, processed and written to the store INCREMENTAL_BATCH at a
+    time as they arrive, so neither the records nor their outputs are ever all in memory.
+    The outputs are stored in out/<name>.incremental.json, after a version line, one "key<TAB>output" line per record;
+    pass --full to ignore them.
+    :returns generator - The output for each record, in the same order as records."""
+    path = f'out/{name}.incremental.json'
+    version = code_version()
+    stored = {} if FULL_BUILD else index_store(path, version)
+    previous = open(path, 'rb') if stored else None
+    processed = reused = 0
+    try:
+        with open(f'{path}.tmp', 'wb') as store:
+            store.write(json.dumps({'version': version}).encode() + b'\n')
+            records = iter(Progress(name, records, log))
+            while True:
+                batch = list(itertools.islice(records, INCREMENTAL_BATCH))
+                if not batch:
+                    break
+                keys = [record_key(r) for r in batch]  # before process gets to mutate them
+                changed = [i for i, key in enumerate(keys) if key not in stored]
+                outputs = dict(zip(changed, process([batch[i] for i in changed]))) if changed else {}
+                del batch
+                for i, key in enumerate(keys):
+                    if i in outputs:
+                        out = outputs.pop(i)
+                        line = f"{json.dumps(key)}\t{json.dumps(out, default=materialize)}\n".encode()
+                    else:
+                        previous.seek(stored[key])
+                        line = previous.readline()
+                        out = json.loads(line[line.index(b'\t') + 1:])
+                    store.write(line)
+                    yield out
+                processed += len(changed)
+                reused += len(keys) - len(changed)
+    finally:
+        if previous is not None:
+            previous.close()
+    os.replace(f'{path}.tmp', path)
+    log.info(f"{name}: processed {processed} new or changed records, reused {reused}")
+
+
+_pools = {}
+
+
+def get_pool(workers):
+    """Returns the pool of worker processes shared by every parallel_map, started the first time it's needed."""
+    if workers not in _pools:
+        _pools[workers] = ProcessPoolExecutor(max_workers=workers)
+    return _pools[workers]
+
+
+def parallel_map(process, records, workers=None):
+    """Shards records into chunks and runs process over each chunk in a pool of worker processes.
+    process must be a module-level function that maps a list of records to a list of outputs, one per record, without
+    looking at any other record. The warnings raised and render cache lookups made in the workers are counted here, as if
+    this process had done the work itself.
+    :returns list - The outputs, in the same order as records."""
+    workers = workers or WORKERS
+    if workers <= 1 or len(records) <= 1:
+        return process(records)
+    size = -(-len(records) // (workers * CHUNKS_PER_WORKER))
+    chunks = [records[i:i + size] for i in range(0, len(records), size)]
+    log.info(f"Processing {len(records)} records in {len(chunks)} chunks on {workers} workers")
+    outputs = []
+    for chunk, warnings, cache_stats in get_pool(workers).map(functools.partial(run_chunk, process), chunks):
+        outputs.extend(chunk)
+        WARNINGS.update(warnings)
+        if cache_stats is not None and RENDER_CACHE is not None:
+            RENDER_CACHE.merge(*cache_stats)
+    return outputs
+
+
+def run_chunk(process, chunk):
+    """Runs process over a chunk in a worker process for parallel_map.
+    :returns tuple - The outputs, the counts of the warnings raised, and the render cache hits, misses and size (or None
+    without a render cache), which would otherwise stay in the worker."""
+    warnings = WARNINGS.copy()
+    cache = RENDER_CACHE
+    hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    outputs = process(chunk)
+    cache_stats = (cache.hits - hits, cache.misses - misses, len(cache)) if cache is not None else None
+    return outputs, WARNINGS - warnings, cache_stats
+
+
+class Overlay(collections.ChainMap):
+    """A record layered over a parent record. Reads fall through to the parent and writes only ever touch the overlay's
+    own fields, so the parent's values are shared instead of copied. Key order matches that of a copy of the parent
+    updated with the overlay's fields."""
+
+    def __init__(self, parent, fields=None):
+        super().__init__(fields if fields is not None else {}, parent)
+
+
+def materialize(obj):
+    """json.dumps default hook, turning overlays into the plain dicts they stand for."""
+    if isinstance(obj, Overlay):
+        return dict(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dump_json(records, path, fmt=None, record_file=None, search_index=None):
+    """Writes records out one at a time, to a temporary file that is renamed over path once it is complete.
+    The pretty format matches json.dump(records, f, indent=4), compact drops all whitespace, and ndjson writes one record
+    per line to a .ndjson file alongside path instead.
+    :param record_file: Whether to also write the records to a record file (see recordfile.RecordFile) at path with a
+    .bin extension, for consumers that want to load records lazily. The JSON stays the canonical output. Defaults to
+    whether --records was passed.
+    :param search_index: Whether to also index the records by name in a search index (see searchindex.SearchIndex) at
+    path with an .index.json extension. Defaults to whether --search-index was passed."""
+    fmt = fmt or DUMP_FORMAT
+    record_file = RECORD_FILES if record_file is None else record_file
+    search_index = SEARCH_INDEX if search_index is None else search_index
+    base = os.path.splitext(path)[0]
+    if fmt == 'ndjson':
+        path = f"{base}.ndjson"
+    tmp = f'{path}.tmp'
+    with contextlib.ExitStack() as stack:
+        f = stack.enter_context(open(tmp, 'w'))
+        binary = stack.enter_context(RecordWriter(f"{base}.bin", materialize)) if record_file else None
+        index = stack.enter_context(IndexWriter(f"{base}.index.json")) if search_index else None
+        if fmt == 'ndjson':
+            for record in records:
+                f.write(json.dumps(record, default=materialize))
+                f.write('\n')
+                if binary is not None:
+                    binary.write(record)
+                if index is not None:
+                    index.add(record)
+        else:
+            sep, head, tail = (',\n    ', '[\n    ', '\n]') if fmt == 'pretty' else (',', '[', ']')
+            empty = True
+            for record in records:
+                f.write(head if empty else sep)
+                if fmt == 'pretty':
+                    f.write(json.dumps(record, indent=4, default=materialize).replace('\n', '\n    '))
+                    if binary is not None:  # the pretty text can't be reused, so the record is serialized again
+                        binary.write(record)
+                else:
+                    text = json.dumps(record, separators=(',', ':'), default=materialize)
+                    f.write(text)
+                    if binary is not None:
+                        binary.write(record, text)
+                if index is not None:
+                    index.add(record)
+                empty = False
+            f.write('[]' if empty else tail)
+    os.replace(tmp, path)
+
+
+def resolve_duplicates(data, rank, rename):
+    """Renames records that share a name, so only the best ranked of them keeps it.
+    Records are bucketed by name once and visited in order; the first time a visited record's name is shared, every
+    record with that name but the lowest ranked (the earliest, on ties) is renamed and moved to its new name's bucket,
+    where it may be resolved again if that name turns out to be shared too.
+    :param rank: A function returning the sort key of a record.
+    :param rename: A function returning the new name of a record that lost its name."""
+    buckets = collections.defaultdict(list)  # name -> indices of the records with that name, in order
+    for i, record in enumerate(data):
+        buckets[record['name']].append(i)
+
+    for record in data:
+        name = record['name']
+        if len(buckets[name]) < 2:
+            continue
+        log.warning(f"Found duplicate: {name}")
+        ranked = sorted(buckets[name], key=lambda i: rank(data[i]))
+        buckets[name] = ranked[:1]
+        for i in ranked[1:]:
+            new_name = rename(data[i])
+            log.info(f"Renaming {name} to {new_name}")
+            data[i]['name'] = new_name
+            bisect.insort(buckets[new_name], i)
+    return data
+
+
 def nth_repl(s, sub, repl, nth):
     find = s.find(sub)
     # if find is not p1 we have found at least one match for the substring
@@ -54,74 +531,218 @@ ABILITY_MAP = {'str': 'Strength', 'dex': 'Dexterity', 'con': 'Constitution',
 ATTACK_TYPES = {"M": "Melee", "R": "Ranged", "W": "Weapon", "S": "Spell"}
 
 
+class RenderCache:
+    """A bounded LRU cache of the strings parse_data_formatting renders, keyed by the string itself. It is an
+    lru_cache, so a lookup costs little more than hashing the string. The warnings a string raises are cached with it
+    and raised again whenever it is looked up, so the warning counts are the same as without the cache.
+    render() goes through it for every string it renders, but lists and entries aren't cached as a whole: keying them
+    costs more than rendering them, even as tuples of strings, and their strings are cached anyway."""
+
+    def __init__(self, maxsize=RENDER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.lookup = functools.lru_cache(maxsize=maxsize)(self._render)
+        self.worker_hits = 0
+        self.worker_misses = 0
+        self.worker_entries = 0  # in the fullest worker's cache
+
+    @staticmethod
+    def _render(text):
+        """:returns tuple - text with its tags rendered, and each (message, logger) warning rendering it raised."""
+        global _deferred
+        outer, _deferred = _deferred, []
+        try:
+            return _parse_data_formatting(text), tuple(_deferred)
+        finally:
+            _deferred = outer
+
+    def merge(self, hits, misses, entries):
+        """Counts the lookups made in a worker process's copy of the cache, which holds entries."""
+        self.worker_hits += hits
+        self.worker_misses += misses
+        self.worker_entries = max(self.worker_entries, entries)
+
+    @property
+    def hits(self):
+        return self.lookup.cache_info().hits + self.worker_hits
+
+    @property
+    def misses(self):
+        return self.lookup.cache_info().misses + self.worker_misses
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+    def __len__(self):
+        return self.lookup.cache_info().currsize
+
+
+RENDER_CACHE = RenderCache() if "memoize" in sys.argv else None
+
+
+def enable_render_cache(maxsize=RENDER_CACHE_SIZE):
+    """Turns on memoization of parse_data_formatting(), which render() renders every string through, for the rest of
+    the run."""
+    global RENDER_CACHE
+    RENDER_CACHE = RenderCache(maxsize)
+    return RENDER_CACHE
+
+
+def log_render_cache_stats():
+    if RENDER_CACHE is None:
+        return
+    entries = f"{len(RENDER_CACHE)}/{RENDER_CACHE.maxsize} entries"
+    if RENDER_CACHE.worker_entries:  # each worker has its own copy of the cache
+        entries += f" here and up to {RENDER_CACHE.worker_entries} in each worker"
+    log.info(f"Render cache: {RENDER_CACHE.hits} hits, {RENDER_CACHE.misses} misses "
+             f"({RENDER_CACHE.hit_rate:.1%} hit rate), {entries}")
+
+
 def render(text, md_breaks=False, join_char='\n'):
     """Parses a list or string from astranauta data.
     :returns str - The final text."""
+    out = []
+    join_str = f'{join_char}' if not md_breaks else f'  {join_char}'
+    render_into(text, out, join_str)
+    return ''.join(out)
+
+
+def render_into(text, out, join_str='\n'):
+    """Renders a list, entry or string from astranauta data, appending the text fragments to out.
+    Tags are parsed once, on each leaf string, so the fragments only need to be joined once at the end."""
     if isinstance(text, dict):
         text = [text]
     if not isinstance(text, list):
-        return parse_data_formatting(str(text))
-
-    out = []
-    join_str = f'{join_char}' if not md_breaks else f'  {join_char}'
+        render_string(text, out)
+        return
 
+    first = True
     for entry in text:
         if not isinstance(entry, dict):
-            out.append(str(entry))
-        elif isinstance(entry, dict):
-            if not 'type' in entry and 'title' in entry:
-                out.append(f"**{entry['title']}**: {render(entry['text'])}")
-            elif not 'type' in entry and 'istable' in entry:  # only for races
-                temp = f"**{entry['caption']}**\n" if 'caption' in entry else ''
-                temp += ' - '.join(f"**{parse_data_formatting(cl)}**" for cl in entry['thead']) + '\n'
-                for row in entry['tbody']:
-                    temp += ' - '.join(f"{parse_data_formatting(col)}" for col in row) + '\n'
-                out.append(temp.strip())
-            elif entry['type'] == 'entries':
-                out.append((f"**{entry['name']}**: " if 'name' in entry else '') + render(
-                    entry['entries']))  # oh gods here we goooooooo
-            elif entry['type'] == 'options':
-                pass  # parsed separately in classfeat
-            elif entry['type'] == 'list':
-                out.append('\n'.join(f"- {render(t)}" for t in entry['items']))
-            elif entry['type'] == 'table':
-                temp = f"**{entry['caption']}**\n" if 'caption' in entry else ''
-                temp += ' - '.join(f"**{parse_data_formatting(cl)}**" for cl in entry['colLabels']) + '\n'
-                for row in entry['rows']:
-                    temp += ' - '.join(f"{render(col)}" for col in row) + '\n'
-                out.append(temp.strip())
-            elif entry['type'] == 'invocation':
-                pass  # this is only found in options
-            elif entry['type'] == 'abilityAttackMod':
-                out.append(f"`{entry['name']} Attack Bonus = "
-                           f"{' or '.join(ABILITY_MAP.get(a) for a in entry['attributes'])}"
-                           f" modifier + Proficiency Bonus`")
-            elif entry['type'] == 'abilityDc':
-                out.append(f"`{entry['name']} Save DC = 8 + "
-                           f"{' or '.join(ABILITY_MAP.get(a) for a in entry['attributes'])}"
-                           f" modifier + Proficiency Bonus`")
-            elif entry['type'] == 'bonus':
-                out.append("{:+}".format(entry['value']))
-            elif entry['type'] == 'dice':
-                out.append(f"{entry['number']}d{entry['faces']}")
-            elif entry['type'] == 'bonusSpeed':
-                out.append(f"{entry['value']} feet")
-            elif entry['type'] == 'actions':
-                out.append((f"**{entry['name']}**: " if 'name' in entry else '') + render(entry['entries']))
-            elif entry['type'] == 'attack':
-                out.append(f"{' '.join(ATTACK_TYPES.get(t) for t in entry['attackType'])} Attack: "
-                           f"{render(entry['attackEntries'])} Hit: {render(entry['hitEntries'])}")
-            elif entry['type'] == 'item':
-                out.append(f"*{entry['name']}* {render(entry['entry'])}")
-            elif entry['type'] == 'cell':
-                out.append(render(entry['entry']))
-            else:
-                log.warning(f"Missing astranauta entry type parse: {entry}")
-
+            renderer = render_string
+        elif not 'type' in entry and 'title' in entry:
+            renderer = render_titled
+        elif not 'type' in entry and 'istable' in entry:  # only for races
+            renderer = render_race_table
+        elif entry['type'] in ENTRY_RENDERERS:
+            renderer = ENTRY_RENDERERS[entry['type']]
+            if renderer is None:
+                continue
         else:
-            log.warning(f"Unknown astranauta entry: {entry}")
+            warn(f"Missing astranauta entry type parse: {entry.get('type')}")
+            if DEBUG:
+                log.debug(f"Unparsed entry: {entry}")
+            continue
+        if not first:
+            out.append(join_str)
+        renderer(entry, out)
+        first = False
+
+
+ENTRY_RENDERERS = {
+    'options': None,  # parsed separately in classfeat
+    'invocation': None  # this is only found in options
+}
+
+
+def entry_renderer(*types):
+    """Registers a function(entry, out) that appends the rendered fragments of an entry type to out."""
+
+    def decorator(func):
+        for t in types:
+            ENTRY_RENDERERS[t] = func
+        return func
+
+    return decorator
+
+
+def render_string(entry, out):
+    out.append(parse_data_formatting(str(entry)))
+
 
-    return parse_data_formatting(join_str.join(out))
+def render_titled(entry, out):
+    out.append(parse_data_formatting(f"**{entry['title']}**: "))
+    render_into(entry['text'], out)
+
+
+def render_race_table(entry, out):
+    temp = parse_data_formatting(f"**{entry['caption']}**\n") if 'caption' in entry else ''
+    temp += ' - '.join(f"**{parse_data_formatting(cl)}**" for cl in entry['thead']) + '\n'
+    for row in entry['tbody']:
+        temp += ' - '.join(f"{parse_data_formatting(col)}" for col in row) + '\n'
+    out.append(temp.strip())
+
+
+@entry_renderer('entries', 'actions')
+def render_entries(entry, out):
+    if 'name' in entry:
+        out.append(parse_data_formatting(f"**{entry['name']}**: "))
+    render_into(entry['entries'], out)  # oh gods here we goooooooo
+
+
+@entry_renderer('list')
+def render_list(entry, out):
+    for i, item in enumerate(entry['items']):
+        out.append("- " if not i else "\n- ")
+        render_into(item, out)
+
+
+@entry_renderer('table')
+def render_table(entry, out):
+    temp = parse_data_formatting(f"**{entry['caption']}**\n") if 'caption' in entry else ''
+    temp += ' - '.join(f"**{parse_data_formatting(cl)}**" for cl in entry['colLabels']) + '\n'
+    for row in entry['rows']:
+        temp += ' - '.join(f"{render(col)}" for col in row) + '\n'
+    out.append(temp.strip())  # tables are stripped as a whole, so they are joined on their own
+
+
+@entry_renderer('abilityAttackMod')
+def render_ability_attack_mod(entry, out):
+    out.append(parse_data_formatting(f"`{entry['name']} Attack Bonus = "
+                                     f"{' or '.join(ABILITY_MAP.get(a) for a in entry['attributes'])}"
+                                     f" modifier + Proficiency Bonus`"))
+
+
+@entry_renderer('abilityDc')
+def render_ability_dc(entry, out):
+    out.append(parse_data_formatting(f"`{entry['name']} Save DC = 8 + "
+                                     f"{' or '.join(ABILITY_MAP.get(a) for a in entry['attributes'])}"
+                                     f" modifier + Proficiency Bonus`"))
+
+
+@entry_renderer('bonus')
+def render_bonus(entry, out):
+    out.append("{:+}".format(entry['value']))
+
+
+@entry_renderer('dice')
+def render_dice(entry, out):
+    out.append(f"{entry['number']}d{entry['faces']}")
+
+
+@entry_renderer('bonusSpeed')
+def render_bonus_speed(entry, out):
+    out.append(f"{entry['value']} feet")
+
+
+@entry_renderer('attack')
+def render_attack(entry, out):
+    out.append(f"{' '.join(ATTACK_TYPES.get(t) for t in entry['attackType'])} Attack: ")
+    render_into(entry['attackEntries'], out)
+    out.append(" Hit: ")
+    render_into(entry['hitEntries'], out)
+
+
+@entry_renderer('item')
+def render_item(entry, out):
+    out.append(parse_data_formatting(f"*{entry['name']}* "))
+    render_into(entry['entry'], out)
+
+
+@entry_renderer('cell')
+def render_cell(entry, out):
+    render_into(entry['entry'], out)
 
 
 def SRC_FORMAT(e):
@@ -139,43 +760,101 @@ PARSING = {'hit': lambda e: f"{int(e):+}",
            'chance': lambda e: e.split('|')[1],
            'atk': lambda e: f"{ATK_TYPES.get(e, 'Unknown')} Attack:"}
 IGNORED = ['dice', 'condition', 'skill', 'action', 'creature', 'item', 'spell', 'damage']
+TAG_RE = re.compile(r'{@(\w+)(?: ([^{}]+?))?}')
+TOKEN_RE = re.compile(r'{@(\w+)(?: ([^{}]+?))?}|[{}]')  # an innermost tag, or a lone brace
+
+
+def render_tag(match):
+    """Renders a single {@tag content} match whose content holds no further tags."""
+    if DEBUG:
+        log.debug(f"Rendering {match.group(0)}...")
+    tag, content = match.group(1, 2)
+    if tag in IGNORED:
+        out = SRC_FORMAT(content)
+    elif tag in PARSING:
+        out = PARSING[tag](content)
+    else:
+        f = FORMATTING.get(tag, '')
+        if not tag in FORMATTING:
+            warn(f"Unknown tag: {tag}")
+        out = f"{f}{content}{f}"
+    if DEBUG:
+        log.debug(f"Replaced {match.group(0)} with {out}")
+    return out
 
 
 def parse_data_formatting(text):
     """Parses a {@format } string."""
-    exp = re.compile(r'{@(\w+)(?: ([^{}]+?))?}')
-
-    def sub(match):
-        log.debug(f"Rendering {match.group(0)}...")
-        if match.group(1) in IGNORED:
-            out = SRC_FORMAT(match.group(2))
-        elif match.group(1) in PARSING:
-            f = PARSING.get(match.group(1), lambda e: e)
-            out = f(match.group(2))
-        else:
-            f = FORMATTING.get(match.group(1), '')
-            if not match.group(1) in FORMATTING:
-                log.warning(f"Unknown tag: {match.group(0)}")
-            out = f"{f}{match.group(2)}{f}"
-        log.debug(f"Replaced with {out}")
+    if '{@' not in text:
+        return text
+    if RENDER_CACHE is not None:
+        out, warnings = RENDER_CACHE.lookup(text)
+        for message, logger in warnings:  # raised again on every lookup, so they count as often as without the cache
+            warn(message, logger)
         return out
+    return _parse_data_formatting(text)
 
-    while exp.search(text):
-        text = exp.sub(sub, text)
-    return text
+
+def _parse_data_formatting(text):
+    """Innermost tags are rendered in one regex pass. Whatever nesting is left is then resolved in a single left-to-right
+    pass, where lone braces open and close fragments that are rendered once all of their inner tags have been."""
+    text = TAG_RE.sub(render_tag, text)
+    if '{@' not in text:
+        return text
+
+    stack = []
+    out = []
+    pos = 0
+    for token in TOKEN_RE.finditer(text):
+        out.append(text[pos:token.start()])
+        pos = token.end()
+        if token.group(1) is not None:
+            out.append(render_tag(token))
+        elif token.group(0) == '{':
+            stack.append(out)
+            out = ['{']
+        elif stack:
+            fragment = ''.join(out) + '}'
+            out = stack.pop()
+            match = TAG_RE.fullmatch(fragment)
+            out.append(render_tag(match) if match else fragment)
+        else:
+            out.append('}')
+    out.append(text[pos:])
+    for fragment in reversed(stack):  # unclosed braces are left as they were
+        fragment.append(''.join(out))
+        out = fragment
+    return ''.join(out)
 
 
 def recursive_tag(value):
     """
-    Recursively renders all tags.
+    Recursively renders all tags. Lists and dicts are updated in place, see tag_tree.
     :param value: The object to render tags from.
     :return: The object, with all tags rendered.
     """
     if isinstance(value, str):
-        return render(value)
-    if isinstance(value, list):
-        return [recursive_tag(i) for i in value]
-    if isinstance(value, dict):
-        for k, v in value.items():
-            value[k] = recursive_tag(v)
+        return parse_data_formatting(value)
+    if isinstance(value, (list, dict)):
+        tag_tree(value)
     return value
+
+
+def tag_tree(value, seen=None):
+    """Renders all tags in the strings nested in a list or dict, in place. Strings without tags are skipped, only the
+    strings that change are written back, and a list or dict reachable twice is only walked once.
+    :returns int - The number of strings that were rewritten."""
+    if seen is None:
+        seen = set()
+    seen.add(id(value))
+    rewritten = 0
+    for k, v in value.items() if isinstance(value, dict) else enumerate(value):
+        if isinstance(v, str):
+            if '{@' in v:
+                out = parse_data_formatting(v)
+                if out != v:
+                    value[k] = out
+                    rewritten += 1
+        elif isinstance(v, (list, dict)) and id(v) not in seen:
+            rewritten += tag_tree(v, seen)
+    return rewritten